@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+
+import time
+
+__author__ = 'Thomas Bell'
+
+def measure_runs(fn, number=100, repeat=5):
+    # seconds per call for each of the repeats
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        runs.append((time.perf_counter() - start) / number)
+
+    return runs
+
+def measure(fn, number=100, repeat=5):
+    return min(measure_runs(fn, number, repeat))
+
+def report(name, seconds, baseline=None):
+    line = "{: <40} {:>12.1f} us".format(name, seconds * 1e6)
+    if baseline:
+        line += "  ({:.1f}x)".format(baseline / seconds)
+    print(line)
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+
+from claspymc.entity import Entity, PlayerEntity
+from claspymc.world import Chunk, Section
+
+from . import measure, report
+from .synthetic import make_chunk_nbt, make_entity_nbt, make_section_nbt
+
+__author__ = 'Thomas Bell'
+
+def roundtrip(cls, tag):
+    return lambda: cls.from_nbt(tag).to_nbt()
+
+def main():
+    for cls in (Section, Chunk, Entity, PlayerEntity):
+        report("{}()".format(cls.__name__), measure(cls, number=2000))
+
+    section = make_section_nbt()
+    chunk = make_chunk_nbt(0, 0, sections=8, entities=16)["Level"]
+    entity = make_entity_nbt(0, 0)
+    player = PlayerEntity().to_nbt()
+
+    for cls, tag in ((Section, section), (Chunk, chunk), (Entity, entity), (PlayerEntity, player)):
+        report("{}.from_nbt".format(cls.__name__), measure(lambda: cls.from_nbt(tag), number=200))
+        report("{}.from_nbt lazy".format(cls.__name__), measure(lambda: cls.from_nbt(tag, lazy=True), number=200))
+        report("{} round-trip".format(cls.__name__), measure(roundtrip(cls, tag), number=200))
+
+    loaded = PlayerEntity.from_nbt(player)
+    if loaded.position != PlayerEntity().position or loaded.abilities.walk_speed != 0.1:
+        raise AssertionError("PlayerEntity did not survive a round-trip")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import os
+import socket
+import threading
+
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from claspymc import varint
+from claspymc.crypto import CryptoSocket, backend
+from claspymc.net import RecvBuffer, SendQueue
+
+from . import measure, report
+
+__author__ = 'Thomas Bell'
+
+# Throughput of one connection over a socket pair, plain and encrypted:
+# frames go through a SendQueue on one end and come out of a RecvBuffer on
+# the other, like the server's own send and receive paths.
+
+class FragmentCryptoSocket(CryptoSocket):
+
+    # encrypts every queued buffer on its own, as sendmsg used to
+    def sendmsg(self, buffers, *args):
+        if not self.cipher:
+            return self.sock.sendmsg(buffers, *args)
+
+        payload = [self.encryptor.update(buf) for buf in buffers]
+        self.sock.sendall(b''.join(payload))
+        return sum(len(buf) for buf in payload)
+
+def make_frames(count=1000, large_every=0):
+    # small packets with a chunk sized one now and then, as the parts a
+    # SendQueue gets: length prefix, packet id and payload
+    frames = []
+    for i in range(count):
+        payload = os.urandom(8192 if large_every and i % large_every == 0 else 40)
+        body = varint.encode(0x25) + payload
+        frames.append((varint.encode(len(body)), body[:1], body[1:]))
+    return frames
+
+def connection(cls, encrypted):
+    a, b = socket.socketpair()
+    sender, receiver = cls(a), CryptoSocket(b)
+    if encrypted:
+        secret = os.urandom(16)
+        sender.init_cipher(Cipher(algorithms.AES(secret), modes.CFB8(secret), backend=backend))
+        receiver.init_cipher(Cipher(algorithms.AES(secret), modes.CFB8(secret), backend=backend))
+    return SendQueue(sender), RecvBuffer(receiver)
+
+def transfer(queue, buffer, frames):
+    def send():
+        for parts in frames:
+            queue.push(*parts)
+        queue.flush()
+
+    thread = threading.Thread(target=send)
+    thread.start()
+    received = 0
+    while received < len(frames):
+        frame = buffer.next_frame()
+        if frame is None:
+            buffer.fill()
+        else:
+            received += 1
+    thread.join()
+    return frame
+
+def main():
+    for workload, frames in (("small", make_frames()), ("mixed", make_frames(large_every=50))):
+        size = sum(len(part) for parts in frames for part in parts)
+        base = None
+        for name, cls, encrypted in (("plain", CryptoSocket, False),
+                                     ("encrypted, per buffer", FragmentCryptoSocket, True),
+                                     ("encrypted, batched", CryptoSocket, True)):
+            queue, buffer = connection(cls, encrypted)
+            last = transfer(queue, buffer, frames)
+            if bytes(last) != b''.join(frames[-1][1:]):
+                raise AssertionError("{} connection corrupted the data".format(name))
+
+            seconds = measure(lambda: transfer(queue, buffer, frames), number=20)
+            base = base or seconds
+            report("{} {} ({:.1f} MB/s)".format(workload, name, size / seconds / 1e6), seconds, base)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+import tracemalloc
+from io import BytesIO
+
+from nbt import nbt
+
+from claspymc import nbtstream
+from claspymc.world import ChunkContainer
+
+from . import measure, report
+from .synthetic import make_chunk_nbt
+
+__author__ = 'Thomas Bell'
+
+def _serialize(tag):
+    buf = BytesIO()
+    tag.write_file(buffer=buf)
+    return buf.getvalue()
+
+def stream(container):
+    # what the chunk streamer touches: the sections and nothing else
+    for section in container.level.sections:
+        section.bytes()
+
+def load(trees, lazy):
+    return [ChunkContainer.from_nbt(tree, lazy=lazy) for tree in trees]
+
+def peak_memory(fn):
+    tracemalloc.start()
+    try:
+        result = fn()
+        return tracemalloc.get_traced_memory()[1], result
+    finally:
+        tracemalloc.stop()
+
+def main():
+    for entities in (0, 16, 64):
+        blobs = [_serialize(make_chunk_nbt(x, 0, sections=8, entities=entities)) for x in range(8)]
+        trees = [nbt.NBTFile(buffer=BytesIO(blob)) for blob in blobs]
+
+        base = measure(lambda: [nbt.NBTFile(buffer=BytesIO(blob)) for blob in blobs], number=2)
+        report("parse nbt.NBTFile, {} entities".format(entities), base)
+        report("parse nbtstream, {} entities".format(entities),
+               measure(lambda: [nbtstream.read(blob) for blob in blobs], number=2), base)
+        report("parse nbtstream with schema, {} entities".format(entities),
+               measure(lambda: [nbtstream.read(blob, ChunkContainer) for blob in blobs], number=2), base)
+
+        peak, _ = peak_memory(lambda: [nbt.NBTFile(buffer=BytesIO(blob)) for blob in blobs])
+        print("{:<48} {:>10.1f} KiB peak".format("parse nbt.NBTFile, {} entities".format(entities), peak / 1024))
+        peak, _ = peak_memory(lambda: [nbtstream.read(blob, ChunkContainer) for blob in blobs])
+        print("{:<48} {:>10.1f} KiB peak".format("parse nbtstream with schema, {} entities".format(entities), peak / 1024))
+
+        eager = load(trees, False)
+        lazy = load(trees, True)
+        for a, b in zip(eager, lazy):
+            if [s.bytes() for s in a.level.sections] != [s.bytes() for s in b.level.sections]:
+                raise AssertionError("lazy chunk encodes differently")
+
+        name = "{} entities".format(entities)
+        base = measure(lambda: load(trees, False), number=5)
+        report("from_nbt eager, " + name, base)
+        report("from_nbt lazy, " + name, measure(lambda: load(trees, True), number=5), base)
+
+        base = measure(lambda: [stream(c) for c in load(trees, False)], number=2)
+        report("from_nbt + stream eager, " + name, base)
+        report("from_nbt + stream lazy, " + name,
+               measure(lambda: [stream(c) for c in load(trees, True)], number=2), base)
+
+        for lazy in (False, True):
+            mode = "lazy" if lazy else "eager"
+            peak, _ = peak_memory(lambda: load(trees, lazy))
+            print("{:<48} {:>10.1f} KiB peak".format("from_nbt {}, {}".format(mode, name), peak / 1024))
+            peak, _ = peak_memory(lambda: [stream(c) for c in load(trees, lazy)])
+            print("{:<48} {:>10.1f} KiB peak".format("from_nbt + stream {}, {}".format(mode, name), peak / 1024))
+
+if __name__ == "__main__":
+    main()
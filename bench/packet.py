@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+from claspymc.packet import ChunkData, JoinGame, OutgoingPlayerPositionLook
+from claspymc.types import \
+    mc_varint, mc_string, mc_int, \
+    mc_ubyte, mc_sbyte, mc_bool, \
+    mc_double, mc_float
+
+from . import measure, report
+
+__author__ = 'Thomas Bell'
+
+def position_look_concat(x, y, z, yaw, pitch, flags, teleport_id):
+    payload = mc_varint(OutgoingPlayerPositionLook.packet_id).bytes()
+    payload += mc_double(x).bytes()
+    payload += mc_double(y).bytes()
+    payload += mc_double(z).bytes()
+    payload += mc_float(yaw).bytes()
+    payload += mc_float(pitch).bytes()
+    payload += mc_sbyte(flags).bytes()
+    payload += mc_varint(teleport_id).bytes()
+    return payload
+
+def join_game_concat(entity_id, gamemode, dimension, difficulty, players, level_type, debug):
+    payload = mc_varint(JoinGame.packet_id).bytes()
+    payload += mc_int(entity_id).bytes()
+    payload += mc_ubyte(gamemode).bytes()
+    payload += mc_sbyte(dimension).bytes()
+    payload += mc_ubyte(difficulty).bytes()
+    payload += mc_ubyte(players).bytes()
+    payload += mc_string(level_type).bytes()
+    payload += mc_bool(debug).bytes()
+    return payload
+
+def chunk_header_concat(x, z, full, bitmask, size):
+    payload = mc_varint(ChunkData.packet_id).bytes()
+    payload += mc_int(x).bytes()
+    payload += mc_int(z).bytes()
+    payload += mc_bool(full).bytes()
+    payload += mc_varint(bitmask).bytes()
+    payload += mc_varint(size).bytes()
+    return payload
+
+CASES = (
+    ("PlayerPositionLook", OutgoingPlayerPositionLook, position_look_concat,
+     (12.5, 64.0, -3.25, 90.0, 12.5, 0, 1234567)),
+    ("JoinGame", JoinGame, join_game_concat,
+     (42, 1, 0, 2, 10, "default", False)),
+    ("ChunkData header", ChunkData, chunk_header_concat,
+     (3, -7, True, 0xFFFF, 40000)),
+)
+
+def main():
+    for name, cls, concat, values in CASES:
+        if bytes(cls._packer.pack(*values)) != concat(*values):
+            raise AssertionError("{} layout encodes differently".format(name))
+
+        base = measure(lambda: concat(*values), number=5000)
+        report("{} concatenated".format(name), base)
+        report("{} layout".format(name), measure(lambda: cls._packer.pack(*values), number=5000), base)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+
+from nbt import region
+
+from claspymc.region import RegionFile
+
+from . import measure, report
+from .synthetic import make_world
+
+__author__ = 'Thomas Bell'
+
+def main():
+    with tempfile.TemporaryDirectory() as path:
+        make_world(path, radius=4)
+        filename = os.path.join(path, "region", "r.0.0.mca")
+        coords = [(x, z) for x in range(5) for z in range(5)]
+
+        base = measure(lambda: region.RegionFile(filename).close(), number=20)
+        report("nbt.region open", base)
+        report("claspymc.region open", measure(lambda: RegionFile(filename).close(), number=20), base)
+
+        reference = region.RegionFile(filename)
+        mapped = RegionFile(filename)
+        for x, z in coords:
+            if reference.get_blockdata(x, z) != mapped.get_blockdata(x, z):
+                raise AssertionError("mapped region reader differs at chunk {}, {}".format(x, z))
+
+        def read_all(reader, method):
+            def run():
+                for x, z in coords:
+                    getattr(reader, method)(x, z)
+            return run
+
+        for method in ("get_blockdata", "get_nbt"):
+            base = measure(read_all(reference, method), number=5)
+            report("nbt.region {} x{}".format(method, len(coords)), base)
+            report("claspymc.region {} x{}".format(method, len(coords)),
+                   measure(read_all(mapped, method), number=5), base)
+
+        reference.close()
+        mapped.close()
+
+if __name__ == "__main__":
+    main()
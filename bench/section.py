@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+
+from claspymc.world import Section
+
+from . import measure, report
+from .synthetic import make_section_nbt
+
+__author__ = 'Thomas Bell'
+
+CASES = (
+    ("uniform", 1, False),
+    ("16 kinds", 16, False),
+    ("256 kinds + add", 256, True),
+)
+
+def main():
+    for name, kinds, add in CASES:
+        section = Section.from_nbt(make_section_nbt(kinds=kinds, add=add))
+        if section._pack_data() != section._pack_data_reference():
+            raise AssertionError("numpy and reference section encoders differ ({})".format(name))
+
+        reference = measure(section._pack_data_reference, number=5)
+        report("Section pack, python ({})".format(name), reference)
+        report("Section pack, numpy ({})".format(name), measure(section._pack_data, number=200), reference)
+        report("Section.bytes, palette ({})".format(name), measure(section.bytes, number=200), reference)
+
+        _, _, bits = section.palette()
+        print("    {} bits per block, {} bytes encoded".format(bits, len(section.bytes())))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+import contextlib
+import zlib
+from io import BytesIO
+from statistics import median
+
+from claspymc import varint
+from claspymc.chunkcache import ChunkPacketCache
+from claspymc.client import AsyncClient
+from claspymc.compress import ZlibCodec
+from claspymc.connection import MCConnection
+from claspymc.net import RecvBuffer, SendQueue
+from claspymc.packet import \
+    IncomingPacket, IncomingPlayerPosition, \
+    ChunkData, OutgoingPlayerPositionLook, PacketLayout
+from claspymc.player import Player
+from claspymc.server import MCServer
+from claspymc.types import mc_varint, mc_string, mc_double, mc_bool, States
+from claspymc.world import Chunk, Section
+from claspymc.zdict import build
+
+from . import measure_runs
+from .synthetic import make_world, make_chunk_nbt, make_section_nbt
+
+__author__ = 'Thomas Bell'
+
+# The benchmark suite: every case runs against a synthetic world generated
+# into a temporary directory. Results are written as JSON so runs from
+# different commits can be compared:
+#
+#   python -m bench.suite -o before.json
+#   python -m bench.suite -o after.json --compare before.json
+
+CASES = []
+
+def case(name, number=1000, repeat=5):
+    def register(factory):
+        CASES.append((name, number, repeat, factory))
+        return factory
+    return register
+
+class FakeSocket:
+
+    # replays a fixed byte stream and swallows everything sent
+    def __init__(self, data=b''):
+        self.data = memoryview(data)
+        self.offset = 0
+        self.sent = 0
+
+    def rewind(self):
+        self.offset = 0
+
+    def settimeout(self, timeout):
+        pass
+
+    def recv_into(self, buf, nbytes=0, flags=0):
+        n = min(nbytes or len(buf), len(self.data) - self.offset)
+        buf[:n] = self.data[self.offset:self.offset+n]
+        self.offset += n
+        return n
+
+    def sendmsg(self, buffers, *args):
+        n = sum(len(buf) for buf in buffers)
+        self.sent += n
+        return n
+
+    def sendall(self, buf, flags=0):
+        self.sent += len(buf)
+
+    def close(self):
+        pass
+
+class BenchConnection(MCConnection):
+
+    def _send_queue(self):
+        # FakeSocket takes everything at once and has no descriptor to poll
+        return SendQueue(self.sock, self.config.get("send_buffer"))
+
+    def start(self):
+        pass
+
+class BenchEnv:
+
+    COMPRESSION = 256
+    def __init__(self):
+        self.directory = tempfile.mkdtemp(prefix="claspymc-bench-")
+        make_world(self.directory, radius=3, sections=8, entities=4)
+        self.config = {
+            "world": self.directory,
+            "host": "127.0.0.1",
+            "port": 0,
+            "ipv6": False,
+            "compression": self.COMPRESSION,
+            "resolve_uuids": False,
+            "max_connections": 64
+        }
+        self.server = MCServer(dict(self.config))
+        self.listening = None
+
+    def connection(self, data=b'', player=False):
+        conn = BenchConnection(self.server, (FakeSocket(data), ("bench", 0)))
+        conn.compression = self.COMPRESSION
+        if player:
+            conn.player = Player(conn, "bench", resolve_uuid=False)
+            conn.state = States.PLAY
+        return conn
+
+    def listen(self):
+        # a real server on an ephemeral port, for the end-to-end cases
+        if self.listening is None:
+            self.listening = MCServer(dict(self.config))
+            self.listening.thread.daemon = True
+            self.listening.start()
+            while self.listening.sock.getsockname()[1] == 0:
+                time.sleep(0.01)
+
+        return self.listening.sock.getsockname()[1]
+
+    def close(self):
+        for server in (self.server, self.listening):
+            if server is not None:
+                server.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+def frame(body, compression):
+    if compression >= 0:
+        body = varint.encode(0) + body
+    return varint.encode(len(body)) + body
+
+@case("mc_varint encode", number=20000)
+def varint_encode(env):
+    return lambda: mc_varint(300).bytes()
+
+@case("mc_varint decode", number=20000)
+def varint_decode(env):
+    fp = BytesIO(mc_varint(300).bytes())
+    def decode():
+        fp.seek(0)
+        return mc_varint.read(fp)
+    return decode
+
+@case("mc_string encode", number=20000)
+def string_encode(env):
+    return lambda: mc_string("minecraft:stone_bricks").bytes()
+
+@case("mc_string decode", number=20000)
+def string_decode(env):
+    fp = BytesIO(mc_string("minecraft:stone_bricks").bytes())
+    def decode():
+        fp.seek(0)
+        return mc_string.read(fp)
+    return decode
+
+@case("Section.bytes", number=500)
+def section_bytes(env):
+    return Section.from_nbt(make_section_nbt(kinds=16)).bytes
+
+@case("Chunk.from_nbt", number=100)
+def chunk_from_nbt(env):
+    tag = make_chunk_nbt(0, 0, sections=8, entities=16)["Level"]
+    return lambda: Chunk.from_nbt(tag)
+
+@case("Chunk.from_nbt lazy", number=1000)
+def chunk_from_nbt_lazy(env):
+    tag = make_chunk_nbt(0, 0, sections=8, entities=16)["Level"]
+    return lambda: Chunk.from_nbt(tag, lazy=True)
+
+@case("ChunkData.send", number=100)
+def chunk_data_send(env):
+    conn = env.connection()
+    chunk = env.server.world.get_chunk(0, 0)
+    def send():
+        env.server.chunk_cache.clear()
+        ChunkData(conn, 0, 0, chunk=chunk).send()
+        conn.flush(wait=True)
+    return send
+
+@case("ChunkData.send cached", number=5000)
+def chunk_data_send_cached(env):
+    conn = env.connection()
+    chunk = env.server.world.get_chunk(0, 0)
+    def send():
+        ChunkData(conn, 0, 0, chunk=chunk).send()
+        conn.flush(wait=True)
+    return send
+
+def chunk_bodies(env):
+    conn = env.connection()
+    conn.compression = -1
+    return [ChunkData(conn, x, z, chunk=env.server.world.get_chunk(x, z)).body()
+            for x in range(-2, 3) for z in range(-2, 3)]
+
+SMALL = bytes(mc_string("minecraft:stone_bricks").bytes()) * 16
+
+@case("zlib.compressobj zdict small", number=5000)
+def zlib_compress_zdict(env):
+    zdict = build(chunk_bodies(env)[1:])
+    def compress():
+        obj = zlib.compressobj(1, zdict=zdict)
+        return obj.compress(SMALL) + obj.flush()
+    return compress
+
+@case("ZlibCodec.compress zdict small", number=5000)
+def codec_compress_zdict(env):
+    codec = ZlibCodec(1, build(chunk_bodies(env)[1:]))
+    return lambda: codec.compress(SMALL)
+
+@case("ChunkPacketCache.get compressed", number=500)
+def chunk_cache_get(env):
+    bodies = chunk_bodies(env)
+    cache = ChunkPacketCache(codec=ZlibCodec(1, build(bodies[1:])))
+    cache.put((0, 0, 0), 0, bodies[0])
+    return lambda: cache.get((0, 0, 0), 0)
+
+MOVEMENTS = 100
+
+@case("from_connection x{} movement".format(MOVEMENTS), number=50)
+def movement_stream(env):
+    layout = PacketLayout(IncomingPlayerPosition.packet_id, mc_double, mc_double, mc_double, mc_bool)
+    data = b''.join(frame(bytes(layout.pack(8.5 + i / MOVEMENTS, 70.0, 8.5, True)), env.COMPRESSION)
+                    for i in range(MOVEMENTS))
+    conn = env.connection(data, player=True)
+    def parse():
+        conn._sock.rewind()
+        conn.recv_buffer = RecvBuffer(conn.sock)
+        for i in range(MOVEMENTS):
+            IncomingPacket.from_connection(conn).recv()
+    return parse
+
+@case("offline login", number=10, repeat=3)
+def offline_login(env):
+    port = env.listen()
+    loop = asyncio.new_event_loop()
+    async def login():
+        client = AsyncClient("127.0.0.1", port, "bench")
+        try:
+            await client.connect()
+            await client.login()
+            while (await client.read_packet())[0] != OutgoingPlayerPositionLook.packet_id:
+                pass
+        finally:
+            client.close()
+    return lambda: loop.run_until_complete(login())
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def run(selected=None):
+    results = {}
+    env = BenchEnv()
+    try:
+        # the server logs connections and packets on stdout
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            for name, number, repeat, factory in CASES:
+                if selected and not any(s in name for s in selected):
+                    continue
+
+                runs = measure_runs(factory(env), number, repeat)
+                results[name] = {
+                    "best": min(runs),
+                    "median": median(runs),
+                    "number": number,
+                    "repeat": repeat
+                }
+    finally:
+        env.close()
+
+    return {
+        "commit": git_commit(),
+        "time": time.time(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "varint_accelerated": varint.accelerated,
+        "results": results
+    }
+
+def print_results(data, baseline=None):
+    base = (baseline or {}).get("results", {})
+    for name, result in data["results"].items():
+        line = "{: <40} {:>12.1f} us".format(name, result["best"] * 1e6)
+        if name in base:
+            line += "  ({:.2f}x)".format(base[name]["best"] / result["best"])
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the benchmark suite.")
+    parser.add_argument("-k", dest="selected", action="append",
+                        help="Only run cases whose name contains this (repeatable).")
+    parser.add_argument("-o", "--output", help="Write the results to this JSON file.")
+    parser.add_argument("--compare", type=argparse.FileType("r"),
+                        help="Results JSON to print speedups against.")
+    args = parser.parse_args()
+
+    baseline = json.load(args.compare) if args.compare else None
+    data = run(args.selected)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(data, f, indent=4)
+
+    print_results(data, baseline)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+import os
+import random
+
+from nbt import nbt, region
+
+__author__ = 'Thomas Bell'
+
+def _byte_array(name, data):
+    tag = nbt.TAG_Byte_Array(name=name)
+    tag.value = bytearray(data)
+    return tag
+
+def make_section_nbt(y=0, kinds=16, add=False, seed=0):
+    rand = random.Random(seed + y)
+    palette = [(rand.randrange(1, 256), rand.randrange(16)) for _ in range(kinds)]
+    blocks = [palette[rand.randrange(kinds)] for _ in range(4096)]
+
+    section = nbt.TAG_Compound()
+    section.tags.append(nbt.TAG_Byte(name="Y", value=y))
+    section.tags.append(_byte_array("Blocks", (b for b, _ in blocks)))
+    section.tags.append(_byte_array("Data",
+            (blocks[i][1] | (blocks[i+1][1] << 4) for i in range(0, 4096, 2))))
+    if add:
+        section.tags.append(_byte_array("Add", (rand.randrange(256) for _ in range(2048))))
+
+    section.tags.append(_byte_array("BlockLight", bytes(2048)))
+    section.tags.append(_byte_array("SkyLight", bytes([0xFF]) * 2048))
+    return section
+
+def _double_list(name, values):
+    tag = nbt.TAG_List(name=name, type=nbt.TAG_Double)
+    tag.tags.extend(nbt.TAG_Double(value=v) for v in values)
+    return tag
+
+def make_entity_nbt(x, z, seed=0):
+    rand = random.Random(seed)
+    entity = nbt.TAG_Compound()
+    entity.tags.append(nbt.TAG_String(name="id", value="Pig"))
+    entity.tags.append(_double_list("Pos", (x*16 + rand.random()*16, 64.0, z*16 + rand.random()*16)))
+    entity.tags.append(_double_list("Motion", (0.0, -0.08, 0.0)))
+    rotation = nbt.TAG_List(name="Rotation", type=nbt.TAG_Float)
+    rotation.tags.extend(nbt.TAG_Float(value=rand.random()*360) for _ in range(2))
+    entity.tags.append(rotation)
+    entity.tags.append(nbt.TAG_Float(name="FallDistance", value=0.0))
+    entity.tags.append(nbt.TAG_Short(name="Fire", value=-1))
+    entity.tags.append(nbt.TAG_Short(name="Air", value=300))
+    entity.tags.append(nbt.TAG_Byte(name="OnGround", value=1))
+    entity.tags.append(nbt.TAG_Long(name="UUIDMost", value=rand.getrandbits(63)))
+    entity.tags.append(nbt.TAG_Long(name="UUIDLeast", value=rand.getrandbits(63)))
+    return entity
+
+def make_tile_entity_nbt(x, y, z, seed=0):
+    rand = random.Random(seed)
+    tile = nbt.TAG_Compound()
+    tile.tags.append(nbt.TAG_String(name="id", value="Chest"))
+    for name, value in zip("xyz", (x, y, z)):
+        tile.tags.append(nbt.TAG_Int(name=name, value=value))
+
+    items = nbt.TAG_List(name="Items", type=nbt.TAG_Compound)
+    for slot in range(27):
+        item = nbt.TAG_Compound()
+        item.tags.append(nbt.TAG_Byte(name="Slot", value=slot))
+        item.tags.append(nbt.TAG_String(name="id", value="minecraft:stone"))
+        item.tags.append(nbt.TAG_Byte(name="Count", value=rand.randrange(1, 65)))
+        item.tags.append(nbt.TAG_Short(name="Damage", value=0))
+        items.tags.append(item)
+
+    tile.tags.append(items)
+    return tile
+
+def make_chunk_nbt(x, z, sections=4, kinds=16, seed=0, entities=0):
+    root = nbt.NBTFile()
+    root.name = ""
+    root.tags.append(nbt.TAG_Int(name="DataVersion", value=169))
+
+    level = nbt.TAG_Compound(name="Level")
+    level.tags.append(nbt.TAG_Int(name="xPos", value=x))
+    level.tags.append(nbt.TAG_Int(name="zPos", value=z))
+    level.tags.append(nbt.TAG_Long(name="LastUpdate", value=0))
+    level.tags.append(nbt.TAG_Byte(name="TerrainPopulated", value=1))
+    level.tags.append(_byte_array("Biomes", bytes(256)))
+    height_map = nbt.TAG_Int_Array(name="HeightMap")
+    height_map.value = [sections * 16] * 256
+    level.tags.append(height_map)
+
+    section_list = nbt.TAG_List(name="Sections", type=nbt.TAG_Compound)
+    for y in range(sections):
+        section_list.tags.append(make_section_nbt(y, kinds=kinds, seed=seed + 31*x + 17*z))
+    level.tags.append(section_list)
+
+    entity_list = nbt.TAG_List(name="Entities", type=nbt.TAG_Compound)
+    tile_list = nbt.TAG_List(name="TileEntities", type=nbt.TAG_Compound)
+    for i in range(entities):
+        entity_list.tags.append(make_entity_nbt(x, z, seed=seed + i))
+        tile_list.tags.append(make_tile_entity_nbt(x*16 + i % 16, 64, z*16 + i // 16, seed=seed + i))
+    level.tags.append(entity_list)
+    level.tags.append(tile_list)
+    root.tags.append(level)
+    return root
+
+def make_level_nbt(spawn=(8, 70, 8)):
+    root = nbt.NBTFile()
+    root.name = ""
+    data = nbt.TAG_Compound(name="Data")
+    data.tags.append(nbt.TAG_String(name="LevelName", value="synthetic"))
+    data.tags.append(nbt.TAG_Byte(name="Difficulty", value=1))
+    for name, value in zip(("SpawnX", "SpawnY", "SpawnZ"), spawn):
+        data.tags.append(nbt.TAG_Int(name=name, value=value))
+    root.tags.append(data)
+    return root
+
+def make_world(path, radius=3, sections=4, kinds=16, entities=0):
+    os.makedirs(os.path.join(path, "region"), exist_ok=True)
+    make_level_nbt().write_file(os.path.join(path, "level.dat"))
+
+    regions = {}
+    try:
+        for x in range(-radius, radius + 1):
+            for z in range(-radius, radius + 1):
+                key = (x >> 5, z >> 5)
+                if key not in regions:
+                    filename = os.path.join(path, "region", "r.{}.{}.mca".format(*key))
+                    open(filename, "wb").close()
+                    regions[key] = region.RegionFile(filename)
+
+                regions[key].write_chunk(x & 0x1f, z & 0x1f, make_chunk_nbt(x, z, sections, kinds, entities=entities))
+    finally:
+        for file in regions.values():
+            file.close()
+
+    return path
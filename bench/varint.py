@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+from io import BytesIO
+
+from claspymc import varint
+from claspymc.types import mc_varint
+
+from . import measure, report
+
+__author__ = 'Thomas Bell'
+
+def legacy_encode(n):
+    # the per-byte loop mc_varnum used before claspymc.varint
+    x = n & 0xFFFFFFFF
+    length = 1
+    while x >= (1 << (7*length)):
+        length += 1
+    buf = bytearray(length)
+    for i in range(length):
+        buf[i] = (x >> (7*i)) & 0x7f
+        if i < length-1:
+            buf[i] |= 0x80
+    return bytes(buf)
+
+def legacy_decode(fp):
+    buf = fp.read(1)
+    while buf[0] & 0x80 and len(buf) < 32:
+        buf = fp.read(1) + buf
+    n = 0
+    for e in buf[::-1]:
+        n = (n << 7) | (e & 0x7f)
+    return n
+
+VALUES = (
+    ("1 byte", 0x2E),
+    ("2 bytes", 0x1234),
+    ("3 bytes", 0x12345),
+    ("5 bytes", -1),
+)
+
+IMPLEMENTATIONS = [("python", varint.py_encode, varint.py_encode_into, varint.py_decode)]
+if varint.accelerated:
+    IMPLEMENTATIONS.append(("C", varint.encode, varint.encode_into, varint.decode))
+
+def main():
+    if not varint.accelerated:
+        print("claspymc._varint not built, only the pure Python fallback is measured")
+
+    buf = bytearray(16)
+    for name, value in VALUES:
+        data = legacy_encode(value)
+        view = memoryview(data)
+        for _, encode, encode_into, decode in IMPLEMENTATIONS:
+            if encode(value) != data or decode(view, 0)[0] != value:
+                raise AssertionError("varint codec disagrees with the legacy encoding")
+
+        base = measure(lambda: legacy_encode(value), number=10000)
+        report("encode legacy ({})".format(name), base)
+        report("mc_varint.bytes ({})".format(name), measure(lambda: mc_varint(value).bytes(), number=10000), base)
+        for impl, encode, encode_into, decode in IMPLEMENTATIONS:
+            report("encode {} ({})".format(impl, name), measure(lambda: encode(value), number=10000), base)
+            report("encode_into {} ({})".format(impl, name),
+                   measure(lambda: encode_into(buf, 0, value), number=10000), base)
+
+        base = measure(lambda: legacy_decode(BytesIO(data)), number=10000)
+        report("decode legacy ({})".format(name), base)
+        for impl, encode, encode_into, decode in IMPLEMENTATIONS:
+            report("decode {} ({})".format(impl, name), measure(lambda: decode(view, 0), number=10000), base)
+
+if __name__ == "__main__":
+    main()
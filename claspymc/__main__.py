@@ -9,24 +9,72 @@ import argparse
 
 from .version import APP_NAME, APP_VERSION
 from .server import MCServer
+from .supervisor import Supervisor
 
 DEFAULT_CONFIG = {
     'max_connections': 32,
     'timeout': 15,
+    "engine": "threaded",
+    "send_buffer": 65536,
+    "send_backlog": {
+        "max_bytes": 4194304,
+        "timeout": 10
+    },
     "host": "",
     "port": 25565,
     "ipv6": True,
     "online": False,
+    "resolve_uuids": True,
+    "workers": 1,
     "compression": 256,
     "difficulty": 1,
     "world": "/home/thomas/Documents/mc/1.9/world",
+    "world_cache": {
+        "chunks": 1024,
+        "regions": 16,
+        "pin_radius": 2,
+        "loader_threads": 2,
+        "prefetch_distance": 3,
+        "lazy_nbt": True
+    },
+    "streaming": {
+        "view_distance": 8,
+        "chunks_per_tick": 4
+    },
+    "chunk_cache": {
+        "max_bytes": 67108864,
+        "compress": False,
+        "level": 1,
+        "zdict": None
+    },
+    "compressor": {
+        "level": -1,
+        "offload_size": 16384,
+        "threads": 2,
+        "report_interval": 60
+    },
+    "ticks": {
+        "rate": 20,
+        "report_interval": 10,
+        "max_inbound": 256
+    },
     "keepalive": {
         "send_interval": 10,
         "timeout": 30
     },
     "players": {
         "max": 10
-    }
+    },
+    "trace": {
+        "level": "off",
+        "packets": [],
+        "exclude": [["play", "in", 0x0B], ["play", "out", 0x1F]],
+        "sample": 1.0,
+        "ring_size": 1024,
+        "capture": None,
+        "stdout": False
+    },
+    "capture": None
 }
 
 
@@ -47,6 +95,8 @@ def main():
 
     parser.add_argument("-c", "--config", default=None, type=argparse.FileType('r'),
             help="The JSON formatted configuration file.")
+    parser.add_argument("-w", "--workers", default=None, type=int,
+            help="Run this many server processes sharing the port.")
     args = parser.parse_args()
 
     try:
@@ -54,8 +104,18 @@ def main():
         if args.config:
             config.update(json.load(args.config))
 
-        for conf in config.get("servers", [{}]):
+        if args.workers is not None:
+            config["workers"] = args.workers
+
+        configs = config.get("servers", [{}])
+        for conf in configs:
             conf.update(config)
+
+        if config.get("workers", 1) > 1:
+            Supervisor(configs, config["workers"]).run()
+            return
+
+        for conf in configs:
             server = MCServer(conf)
             server.start()
             servers.append(server)
@@ -0,0 +1,204 @@
+/*
+ * Optional accelerator for claspymc.varint, same functions and semantics as
+ * the py_* fallbacks (arguments are positional only). Build with:
+ *
+ *   gcc -O2 -shared -fPIC $(python3-config --includes) claspymc/_varint.c \
+ *       -o claspymc/_varint$(python3-config --extension-suffix)
+ */
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdint.h>
+
+static int
+parse_width(PyObject *const *args, Py_ssize_t nargs, Py_ssize_t index, int *width)
+{
+    long w;
+
+    *width = 32;
+    if (nargs <= index)
+        return 0;
+
+    w = PyLong_AsLong(args[index]);
+    if (w == -1 && PyErr_Occurred())
+        return -1;
+    if (w != 32 && w != 64) {
+        PyErr_SetString(PyExc_ValueError, "width must be 32 or 64");
+        return -1;
+    }
+    *width = (int)w;
+    return 0;
+}
+
+static int
+as_unsigned(PyObject *value, int width, uint64_t *result)
+{
+    /* two's complement of the low bits, like `value & ((1 << width) - 1)` */
+    unsigned long long n = PyLong_AsUnsignedLongLongMask(value);
+    if (n == (unsigned long long)-1 && PyErr_Occurred())
+        return -1;
+    if (width == 32)
+        n &= 0xFFFFFFFFULL;
+    *result = (uint64_t)n;
+    return 0;
+}
+
+static Py_ssize_t
+write_varint(unsigned char *out, uint64_t value)
+{
+    Py_ssize_t n = 0;
+    while (value >= 0x80) {
+        out[n++] = (unsigned char)((value & 0x7F) | 0x80);
+        value >>= 7;
+    }
+    out[n++] = (unsigned char)value;
+    return n;
+}
+
+static Py_ssize_t
+varint_size(uint64_t value)
+{
+    Py_ssize_t n = 1;
+    while (value >= 0x80) {
+        value >>= 7;
+        n++;
+    }
+    return n;
+}
+
+static PyObject *
+varint_encode(PyObject *self, PyObject *const *args, Py_ssize_t nargs)
+{
+    unsigned char out[10];
+    uint64_t value;
+    int width;
+
+    if (nargs < 1 || nargs > 2) {
+        PyErr_SetString(PyExc_TypeError, "encode(value, width=32)");
+        return NULL;
+    }
+    if (parse_width(args, nargs, 1, &width) < 0 || as_unsigned(args[0], width, &value) < 0)
+        return NULL;
+
+    return PyBytes_FromStringAndSize((const char *)out, write_varint(out, value));
+}
+
+static PyObject *
+varint_encode_into(PyObject *self, PyObject *const *args, Py_ssize_t nargs)
+{
+    unsigned char out[10];
+    Py_buffer view;
+    Py_ssize_t offset, n;
+    uint64_t value;
+    int width;
+
+    if (nargs < 3 || nargs > 4) {
+        PyErr_SetString(PyExc_TypeError, "encode_into(buf, offset, value, width=32)");
+        return NULL;
+    }
+    offset = PyLong_AsSsize_t(args[1]);
+    if (offset == -1 && PyErr_Occurred())
+        return NULL;
+    if (parse_width(args, nargs, 3, &width) < 0 || as_unsigned(args[2], width, &value) < 0)
+        return NULL;
+    if (PyObject_GetBuffer(args[0], &view, PyBUF_WRITABLE) < 0)
+        return NULL;
+
+    n = write_varint(out, value);
+    if (offset < 0 || offset + n > view.len) {
+        PyBuffer_Release(&view);
+        PyErr_SetString(PyExc_IndexError, "VarInt does not fit in buffer");
+        return NULL;
+    }
+    memcpy((unsigned char *)view.buf + offset, out, n);
+    PyBuffer_Release(&view);
+
+    return PyLong_FromSsize_t(offset + n);
+}
+
+static PyObject *
+varint_decode(PyObject *self, PyObject *const *args, Py_ssize_t nargs)
+{
+    Py_buffer view;
+    Py_ssize_t offset = 0, i, limit;
+    const unsigned char *data;
+    uint64_t result = 0;
+    int width, shift = 0;
+
+    if (nargs < 1 || nargs > 3) {
+        PyErr_SetString(PyExc_TypeError, "decode(buf, offset=0, width=32)");
+        return NULL;
+    }
+    if (nargs > 1) {
+        offset = PyLong_AsSsize_t(args[1]);
+        if (offset == -1 && PyErr_Occurred())
+            return NULL;
+    }
+    if (parse_width(args, nargs, 2, &width) < 0)
+        return NULL;
+    if (PyObject_GetBuffer(args[0], &view, PyBUF_SIMPLE) < 0)
+        return NULL;
+
+    data = (const unsigned char *)view.buf;
+    limit = width == 32 ? 5 : 10;
+    for (i = 0; i < limit; i++) {
+        unsigned char b;
+        if (offset < 0 || offset + i >= view.len) {
+            PyBuffer_Release(&view);
+            PyErr_SetString(PyExc_IndexError, "VarInt truncated");
+            return NULL;
+        }
+        b = data[offset + i];
+        result |= (uint64_t)(b & 0x7F) << shift;
+        if (b < 0x80) {
+            PyObject *value;
+            PyBuffer_Release(&view);
+            if (width == 32)
+                value = PyLong_FromLong((long)(int32_t)(uint32_t)result);
+            else
+                value = PyLong_FromLongLong((long long)(int64_t)result);
+            if (value == NULL)
+                return NULL;
+            return Py_BuildValue("(Nn)", value, offset + i + 1);
+        }
+        shift += 7;
+    }
+
+    PyBuffer_Release(&view);
+    PyErr_SetString(PyExc_ValueError, "VarInt too long");
+    return NULL;
+}
+
+static PyObject *
+varint_size_py(PyObject *self, PyObject *const *args, Py_ssize_t nargs)
+{
+    uint64_t value;
+    int width;
+
+    if (nargs < 1 || nargs > 2) {
+        PyErr_SetString(PyExc_TypeError, "size(value, width=32)");
+        return NULL;
+    }
+    if (parse_width(args, nargs, 1, &width) < 0 || as_unsigned(args[0], width, &value) < 0)
+        return NULL;
+
+    return PyLong_FromSsize_t(varint_size(value));
+}
+
+static PyMethodDef varint_methods[] = {
+    {"encode", (PyCFunction)(void (*)(void))varint_encode, METH_FASTCALL, NULL},
+    {"encode_into", (PyCFunction)(void (*)(void))varint_encode_into, METH_FASTCALL, NULL},
+    {"decode", (PyCFunction)(void (*)(void))varint_decode, METH_FASTCALL, NULL},
+    {"size", (PyCFunction)(void (*)(void))varint_size_py, METH_FASTCALL, NULL},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef varint_module = {
+    PyModuleDef_HEAD_INIT, "_varint", NULL, -1, varint_methods
+};
+
+PyMODINIT_FUNC
+PyInit__varint(void)
+{
+    return PyModule_Create(&varint_module);
+}
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+import sys
+import zlib
+import asyncio
+
+from .connection import MCConnection
+from .packet import IncomingPacket, Disconnect
+from .net import ProtocolError, IllegalData, SendQueue
+from . import varint
+from .types import States
+
+__author__ = 'Thomas Bell'
+
+class StreamSocket:
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def send(self, buf, flags=0):
+        self.sendall(buf, flags)
+        return len(buf)
+
+    def sendmsg(self, buffers, *args):
+        if self.writer.is_closing():
+            raise BrokenPipeError("transport is closed")
+
+        self.writer.writelines(buffers)
+        return sum(len(buf) for buf in buffers)
+
+    def sendall(self, buf, flags=0):
+        if self.writer.is_closing():
+            raise BrokenPipeError("transport is closed")
+
+        # the transport can hold on to what it could not send yet, and
+        # CryptoSocket reuses its buffer
+        if not isinstance(buf, bytes):
+            buf = bytes(buf)
+        self.writer.write(buf)
+
+    def settimeout(self, timeout):
+        pass
+
+    def shutdown(self, how):
+        pass
+
+    def close(self):
+        self.writer.close()
+
+class AsyncMCConnection(MCConnection):
+
+    READ_SIZE = 65536
+    def __init__(self, server, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.loop = asyncio.get_running_loop()
+        super().__init__(server, (StreamSocket(writer), writer.get_extra_info("peername")))
+
+    def _send_queue(self):
+        # the transport buffers what the peer hasn't taken yet
+        return SendQueue(self.sock, self.config.get("send_buffer"))
+
+    def start(self):
+        pass
+
+    def backlog(self):
+        return super().backlog() + self.writer.transport.get_write_buffer_size()
+
+    def close(self):
+        stalled = not self.closed and self.backlogged is not None
+        super().close()
+        if stalled:
+            # closing waits for the peer to read what is buffered, it won't
+            self.writer.transport.abort()
+
+    async def _decompress(self, frame):
+        # big compressed frames are inflated on the compression pool so the
+        # event loop keeps serving the other connections
+        compressor = self.server.compressor
+        if self.compression < 0 or not frame:
+            return None
+
+        try:
+            length, offset = varint.decode(frame)
+        except (IndexError, ValueError) as e:
+            raise IllegalData("Incoming packet format invalid: {}".format(str(e)))
+
+        if length < self.compression or not compressor.offload(length):
+            return None
+
+        try:
+            return await self.loop.run_in_executor(compressor.pool, compressor.decompress,
+                                                   bytes(frame[offset:]), length)
+        except (zlib.error, ValueError) as e:
+            raise IllegalData("Bad compressed packet: {}".format(e))
+
+    async def flush_async(self):
+        # frames still on the compression pool are awaited rather than
+        # blocking the loop, what the tick queues meanwhile goes out with them
+        self.flush()
+        pending = self.send_queue.pending()
+        while pending is not None and not self.closed:
+            await asyncio.wrap_future(pending)
+            self.flush()
+            pending = self.send_queue.pending()
+
+        await self.writer.drain()
+
+    async def packets(self):
+        # the buffered packets, stopping while the tick has a full queue from
+        # this connection, the rest stay in the buffer until there is room
+        while not self.closed and len(self.inbound) < self.max_inbound:
+            frame = self.recv_buffer.next_frame()
+            if frame is None:
+                return
+
+            data = await self._decompress(frame)
+            yield IncomingPacket.from_frame(self, frame, data)
+
+    async def _worker(self):
+        timeout = self.config.get("timeout") or 15
+        try:
+            while not self.closed:
+                if len(self.inbound) >= self.max_inbound:
+                    # the tick is behind on this connection, stop reading until it catches up
+                    await asyncio.sleep(self.server.ticker.interval)
+                else:
+                    data = await asyncio.wait_for(self.reader.read(self.READ_SIZE), timeout)
+                    if not data:
+                        raise ProtocolError("connection closed")
+                    self.recv_buffer.feed(data)
+
+                async for pkt in self.packets():
+                    if self.state != States.PLAY:
+                        if pkt.blocking:
+                            # login lookups, the other connections keep going meanwhile
+                            await self.loop.run_in_executor(None, pkt.prepare)
+                        pkt.recv()
+                    else:
+                        self.inbound.append(pkt)
+
+                await self.flush_async()
+
+        except IllegalData as e:
+            print(e, file=sys.stderr)
+            pkt = Disconnect(self, str(e))
+            pkt.send()
+
+        except asyncio.TimeoutError:
+            print("timed out", file=sys.stderr)
+
+        except (ProtocolError, ConnectionError) as e:
+            print(e, file=sys.stderr)
+
+        finally:
+            self.close()
+
+
+class AsyncEngine:
+
+    def __init__(self, server):
+        self.server = server
+        self.config = server.config
+        self.loop = None
+        self.listener = None
+        self.ticker = None
+
+    def run(self):
+        try:
+            asyncio.run(self._serve())
+        except asyncio.CancelledError:
+            pass
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.ticker = self.loop.create_task(self.server.ticker.run_async())
+        self.listener = await asyncio.start_server(self._accept, sock=self.server.sock,
+                backlog=self.config.get("max_connections", 32))
+
+        async with self.listener:
+            await self.listener.serve_forever()
+
+    async def _accept(self, reader, writer):
+        connections = self.server.connections
+        if len(connections) >= self.config.get("max_connections", 32):
+            # send unavailable connection error
+            writer.close()
+            return
+
+        conn = AsyncMCConnection(self.server, reader, writer)
+        connections.append(conn)
+        print("open <{}:{}>: ({} total)".format(conn.addr[0], conn.addr[1], len(connections)))
+
+        await conn._worker()
+
+    def _stop(self):
+        for conn in self.server.connections:
+            if conn: conn.close()
+
+        self.ticker.cancel()
+        self.listener.close()
+
+    def stop(self):
+        if self.loop is not None and self.listener is not None:
+            self.loop.call_soon_threadsafe(self._stop)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import time
+import struct
+import threading
+import zlib
+from collections import namedtuple, deque
+from concurrent.futures import Future, wait
+
+from . import varint
+from .trace import INBOUND, OUTBOUND
+
+__author__ = 'Thomas Bell'
+
+# Raw session capture: frames as they are on the wire after decryption and
+# before decompression, without the outer length prefix. The compression
+# threshold in effect is stored with each frame so it can be decoded later.
+
+CaptureRecord = namedtuple("CaptureRecord", "time connection direction state compression frame")
+
+MAGIC = b"CLSPCAP1"
+RECORD = struct.Struct("!dIBBiI")
+
+class SessionCapture:
+
+    # Frames still on the compression pool are written from their done
+    # callback, the records after them wait so the file stays in send order.
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.waiting = deque()
+
+    def _add(self, conn, direction, parts):
+        with self.lock:
+            if self.file is None:
+                return
+
+            if direction == INBOUND and self.waiting:
+                # the frame is in a buffer that gets reused once this returns
+                parts = (bytes(parts[0]),)
+            self.waiting.append(((time.time(), conn.trace_id, direction,
+                                  int(conn.state), conn.compression), parts))
+        self._drain()
+
+    def _drain(self, future=None):
+        with self.lock:
+            while self.waiting and self.file is not None:
+                fields, parts = self.waiting[0]
+                if any(isinstance(part, Future) and not part.done() for part in parts):
+                    return
+
+                self.waiting.popleft()
+                if any(isinstance(part, Future) and part.exception() for part in parts):
+                    continue
+
+                frame = b''.join(part.result() if isinstance(part, Future) else part for part in parts)
+                if fields[2] == OUTBOUND:
+                    # outgoing frames are queued with their length prefix
+                    length, offset = varint.decode(frame)
+                    frame = memoryview(frame)[offset:]
+
+                self.file.write(RECORD.pack(*fields, len(frame)))
+                self.file.write(frame)
+
+    def record(self, conn, direction, frame):
+        self._add(conn, direction, (frame,))
+
+    def record_sent(self, conn, parts):
+        self._add(conn, OUTBOUND, parts)
+        for part in parts:
+            if isinstance(part, Future):
+                part.add_done_callback(self._drain)
+
+    def close(self):
+        with self.lock:
+            pending = [part for fields, parts in self.waiting for part in parts if isinstance(part, Future)]
+        wait(pending)
+        self._drain()
+
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+def read_capture(fp):
+    if fp.read(len(MAGIC)) != MAGIC:
+        raise ValueError("not a session capture")
+
+    while True:
+        header = fp.read(RECORD.size)
+        if len(header) < RECORD.size:
+            return
+
+        t, connection, direction, state, compression, length = RECORD.unpack(header)
+        frame = fp.read(length)
+        if len(frame) < length:
+            return
+
+        yield CaptureRecord(t, connection, direction, state, compression, frame)
+
+def load_sessions(path, direction=INBOUND):
+    # {connection: [records]} in capture order
+    sessions = {}
+    with open(path, "rb") as fp:
+        for record in read_capture(fp):
+            if direction is None or record.direction == direction:
+                sessions.setdefault(record.connection, []).append(record)
+
+    return sessions
+
+def frame_body(frame, compression):
+    # the packet id and payload of a captured frame
+    if compression < 0:
+        return bytes(frame)
+
+    length, offset = varint.decode(frame)
+    if length == 0:
+        return bytes(frame[offset:])
+    return zlib.decompress(frame[offset:])
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+import threading
+from collections import OrderedDict
+
+__author__ = 'Thomas Bell'
+
+class ChunkPacketCache:
+
+    # With a codec the frames are stored compressed (only worth it when they
+    # are not compressed for the network already) and inflated on every hit.
+    # Frames still on the compression pool are handed out as their future,
+    # so players asking for the same chunk meanwhile share the work.
+
+    MAX_BYTES = 64 * 1024 * 1024
+    def __init__(self, max_bytes=None, codec=None):
+        self.max_bytes = max_bytes if max_bytes is not None else self.MAX_BYTES
+        self.codec = codec
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.size = 0
+        self.raw_size = 0
+
+        self.hits = 0
+        self.shared = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, stamp):
+        # a frame, or a future of one
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is None or entry[0] != stamp:
+                pending = self.pending.get(key, None)
+                if pending is not None and pending[0] == stamp:
+                    self.shared += 1
+                    return pending[1]
+
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+        if self.codec is not None:
+            return self.codec.decompress(entry[1], entry[2])
+        return entry[1]
+
+    def put(self, key, stamp, frame):
+        raw = len(frame)
+        if self.codec is not None:
+            frame = self.codec.compress(frame)
+
+        with self.lock:
+            self._remove(key)
+            if len(frame) > self.max_bytes:
+                return
+
+            self.entries[key] = (stamp, frame, raw)
+            self.size += len(frame)
+            self.raw_size += raw
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def put_future(self, key, stamp, future):
+        with self.lock:
+            self.pending[key] = (stamp, future)
+        future.add_done_callback(lambda f: self._resolved(key, stamp, f))
+
+    def _resolved(self, key, stamp, future):
+        if not future.exception():
+            self.put(key, stamp, future.result())
+
+        with self.lock:
+            if self.pending.get(key, (None, None))[1] is future:
+                del self.pending[key]
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+            self.raw_size -= entry[2]
+
+    def invalidate(self, key):
+        with self.lock:
+            self._remove(key)
+            self.pending.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.pending.clear()
+            self.size = 0
+            self.raw_size = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "raw_bytes": self.raw_size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "shared": self.shared,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
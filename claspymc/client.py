@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import asyncio
+import zlib
+from io import BytesIO
+
+from . import varint
+from .net import ProtocolError, IllegalData, read_frame_header
+from .packet import \
+    HandshakePacket, LoginStart, LoginSuccess, SetCompression, \
+    IncomingKeepAlive, OutgoingKeepAlive
+from .types import mc_string, mc_ushort, States
+
+__author__ = 'Thomas Bell'
+
+# Minimal asyncio client side of the protocol (offline mode only), used by
+# the replay and load generation tools.
+
+class AsyncClient:
+
+    PROTOCOL = 107
+    READ_SIZE = 65536
+    def __init__(self, host, port, username):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.reader = None
+        self.writer = None
+        self.buffer = bytearray()
+        self.compression = -1
+        self.state = States.HANDSHAKING
+
+        self.sent_packets = 0
+        self.recv_packets = 0
+        self.recv_bytes = 0
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    def send_body(self, body):
+        # body is the packet id followed by the payload
+        if self.compression >= 0:
+            if len(body) >= self.compression:
+                body = varint.encode(len(body)) + zlib.compress(body)
+            else:
+                body = varint.encode(0) + body
+
+        self.writer.write(varint.encode(len(body)) + body)
+        self.sent_packets += 1
+
+    def send(self, packet_id, payload=b''):
+        self.send_body(varint.encode(packet_id) + payload)
+
+    def _next_frame(self):
+        header = read_frame_header(self.buffer)
+        if header is None:
+            return None
+
+        length, offset = header
+        if offset + length > len(self.buffer):
+            return None
+
+        frame = bytes(self.buffer[offset:offset+length])
+        del self.buffer[:offset+length]
+        return frame
+
+    async def read_packet(self):
+        # returns (packet id, payload)
+        frame = self._next_frame()
+        while frame is None:
+            data = await self.reader.read(self.READ_SIZE)
+            if not data:
+                raise ProtocolError("connection closed")
+
+            self.recv_bytes += len(data)
+            self.buffer += data
+            frame = self._next_frame()
+
+        if self.compression >= 0:
+            length, offset = varint.decode(frame)
+            frame = zlib.decompress(frame[offset:]) if length else frame[offset:]
+
+        packet_id, offset = varint.decode(frame)
+        payload = bytes(frame[offset:])
+        self.recv_packets += 1
+
+        # the server's outgoing packets are what this side receives
+        if self.state == States.LOGIN:
+            if packet_id == SetCompression.packet_id:
+                self.compression, _ = varint.decode(payload)
+            elif packet_id == LoginSuccess.packet_id:
+                self.state = States.PLAY
+
+        elif self.state == States.PLAY and packet_id == OutgoingKeepAlive.packet_id:
+            self.send(IncomingKeepAlive.packet_id, payload)
+
+        return packet_id, payload
+
+    async def login(self):
+        # handshake and offline login, returns once the server switched to PLAY
+        self.send(HandshakePacket.packet_id, varint.encode(self.PROTOCOL) + mc_string(self.host).bytes() +
+                  mc_ushort(self.port).bytes() + varint.encode(States.LOGIN))
+        self.state = States.LOGIN
+        self.send(LoginStart.packet_id, mc_string(self.username).bytes())
+        await self.writer.drain()
+
+        while self.state != States.PLAY:
+            packet_id, payload = await self.read_packet()
+            if self.state == States.LOGIN and packet_id == 0x00:  # login disconnect
+                raise IllegalData("disconnected during login: {}".format(mc_string.read(BytesIO(payload))))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
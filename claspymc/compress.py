@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+import time
+import zlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . import varint
+
+__author__ = 'Thomas Bell'
+
+class ZlibCodec:
+
+    # With a preset dictionary, keeps a compressobj per thread with the
+    # dictionary loaded and compresses with copies of it, which saves loading
+    # the dictionary on every call. Without one a copy costs as much as a
+    # fresh object, so plain zlib is used. Decompression only loads the
+    # dictionary once the stream asks for it, so there is nothing to reuse.
+
+    def __init__(self, level=None, zdict=None):
+        self.level = zlib.Z_DEFAULT_COMPRESSION if level is None else level
+        self.zdict = zdict
+        self.local = threading.local()
+
+    def _compressor(self):
+        template = getattr(self.local, "compressor", None)
+        if template is None:
+            template = self.local.compressor = zlib.compressobj(self.level, zdict=self.zdict)
+        return template.copy()
+
+    def compress(self, data):
+        if self.zdict is None:
+            return zlib.compress(data, self.level)
+
+        obj = self._compressor()
+        return obj.compress(data) + obj.flush()
+
+    def decompress(self, data, max_length=0):
+        # with max_length, anything longer is an error rather than inflated
+        obj = zlib.decompressobj() if self.zdict is None else zlib.decompressobj(zdict=self.zdict)
+        if max_length:
+            out = obj.decompress(data, max_length + 1)
+            if len(out) > max_length:
+                raise ValueError("Decompressed data longer than {}".format(max_length))
+        else:
+            out = obj.decompress(data)
+
+        if not obj.eof:
+            raise zlib.error("Incomplete compressed data")
+        return out
+
+class Compressor:
+
+    # zlib for compressed frames. Bodies of at least offload_size bytes are
+    # compressed on a shared pool (zlib releases the GIL while it works), smaller
+    # ones inline. Keeps count, bytes and time per direction and packet id.
+
+    OFFLOAD_SIZE = 16384
+    THREADS = 2
+    REPORT_INTERVAL = 60
+    def __init__(self, level=None, offload_size=None, threads=None, report_interval=None):
+        self.codec = ZlibCodec(level)
+        self.report_interval = self.REPORT_INTERVAL if report_interval is None else report_interval
+        self.reported = 0
+        self.level = self.codec.level
+        self.offload_size = offload_size or self.OFFLOAD_SIZE
+        threads = self.THREADS if threads is None else threads
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="compress") if threads > 0 else None
+
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.offloaded = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(level=config.get("level", None),
+                   offload_size=config.get("offload_size", None),
+                   threads=config.get("threads", None),
+                   report_interval=config.get("report_interval", None))
+
+    def offload(self, size):
+        return self.pool is not None and size >= self.offload_size
+
+    def _record(self, direction, packet_id, raw, compressed, seconds):
+        with self.lock:
+            entry = self.metrics.get((direction, packet_id), None)
+            if entry is None:
+                entry = self.metrics[(direction, packet_id)] = [0, 0, 0, 0.0]
+            entry[0] += 1
+            entry[1] += raw
+            entry[2] += compressed
+            entry[3] += seconds
+
+    def compress(self, body, packet_id):
+        start = time.perf_counter()
+        data = self.codec.compress(body)
+        self._record("out", packet_id, len(body), len(data), time.perf_counter() - start)
+        return data
+
+    def _frame(self, body, packet_id):
+        data = self.compress(body, packet_id)
+        length = varint.encode(len(body))
+        return varint.encode(len(data) + len(length)) + length, data
+
+    def _joined_frame(self, body, packet_id):
+        return b''.join(self._frame(body, packet_id))
+
+    def frame(self, body, packet_id):
+        # the parts of a compressed frame, or for big bodies a single future
+        # of the whole frame, which SendQueue resolves in order
+        if self.offload(len(body)):
+            with self.lock:
+                self.offloaded += 1
+            return (self.pool.submit(self._joined_frame, body, packet_id),)
+
+        return self._frame(body, packet_id)
+
+    def decompress(self, data, length):
+        start = time.perf_counter()
+        body = self.codec.decompress(data, length)
+        if len(body) != length:
+            raise ValueError("Decompressed length {} does not match {}".format(len(body), length))
+
+        packet_id, _ = varint.decode(body)
+        self._record("in", packet_id, length, len(data), time.perf_counter() - start)
+        return body
+
+    def stats(self):
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+            offloaded = self.offloaded
+
+        packets = {}
+        for (direction, packet_id), (count, raw, compressed, seconds) in metrics:
+            packets.setdefault(direction, {})["{:#04x}".format(packet_id)] = {
+                "count": count,
+                "raw_bytes": raw,
+                "compressed_bytes": compressed,
+                "ratio": compressed / raw if raw else None,
+                "us_per_packet": 1e6 * seconds / count
+            }
+
+        return {"level": self.level, "offload_size": self.offload_size,
+                "offloaded": offloaded, "packets": packets}
+
+    def report(self):
+        # one line per direction and packet id, when anything happened since the last one
+        stats = self.stats()
+        count = sum(p["count"] for packets in stats["packets"].values() for p in packets.values())
+        if count == self.reported:
+            return
+        self.reported = count
+
+        print("compression: level {}, {} offloaded".format(stats["level"], stats["offloaded"]))
+        for direction, packets in stats["packets"].items():
+            for packet_id, p in packets.items():
+                print("compression: {} {} {} packets, {} -> {} bytes ({:.2f}), {:.0f} us per packet".format(
+                    direction, packet_id, p["count"], p["raw_bytes"], p["compressed_bytes"],
+                    p["ratio"] or 0, p["us_per_packet"]))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
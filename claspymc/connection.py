@@ -1,31 +1,49 @@
 #!/usr/bin/env python3
 
 import sys
+import time
+import socket
 import threading
+from collections import deque
 
 from .packet import \
     SetCompression, LoginSuccess, JoinGame, \
     OutgoingPluginMessage, IncomingPacket, Disconnect
 from .crypto import CryptoState
 from .keepalive import KeepAlive
-from .player import Player
+from .player import Player, lookup_uuid
 
-from .net import ProtocolError, IllegalData
+from .net import ProtocolError, IllegalData, RecvBuffer, SendQueue
 from .types import mc_varint, mc_string, States
 from .version import APP_NAME, APP_VERSION
 
 class MCConnection:
 
     closed = False
+    spawned = False  # the login burst is out, the tick may move and stream for the player
     version = mc_varint(-1)
+    backlogged = None  # since when the send backlog has been over the limit
+    MAX_INBOUND = 256
+    MAX_BACKLOG = 4194304
+    BACKLOG_TIMEOUT = 10
     def __init__(self, server, conn_info):
         self.server = server
         self.config = server.config
+        self.tracer = server.tracer
+        self.trace_id = self.tracer.next_id()
+        self.capture = server.capture
         self._sock, self.addr = conn_info
         self._sock.settimeout(self.config.get("timeout") or 15)
 
         self.crypto = CryptoState(self)
         self.sock = self.crypto.sock
+        self.recv_buffer = RecvBuffer(self.sock)
+        self.send_queue = self._send_queue()
+        self.inbound = deque()  # PLAY packets waiting for the server tick
+        self.max_inbound = self.config.get("ticks", {}).get("max_inbound", None) or self.MAX_INBOUND
+        backlog = self.config.get("send_backlog", {})
+        self.max_backlog = backlog.get("max_bytes", None) or self.MAX_BACKLOG
+        self.backlog_timeout = backlog.get("timeout", None) or self.BACKLOG_TIMEOUT
 
         self.keepalive = KeepAlive(self)
 
@@ -33,26 +51,44 @@ class MCConnection:
         self.compression = -1
         self.state = States.HANDSHAKING
 
+        self.start()
+
+    def _send_queue(self):
+        # the tick flushes every connection on its one thread, so sends never
+        # wait for a peer that stopped reading
+        return SendQueue(self.sock, self.config.get("send_buffer"), blocking=False)
+
+    def start(self):
         self.thread = threading.Thread(target=self._worker, daemon=True)
         self.thread.start()
 
-    def assign_player(self, username):
-        self.player = Player(self, username, resolve_uuid=True)
+    def lookup_uuid(self, username):
+        # blocks on a web request unless uuids are offline ones
+        if self.config.get("resolve_uuids", True):
+            return lookup_uuid(username)
+        return None
+
+    def assign_player(self, username, player_uuid=None):
+        self.player = Player(self, username, player_uuid=player_uuid)
         self.server.players.append(self.player)
+        self.server.update_status()
         self.server.entities.append(self.player.entity)
 
     def join_game(self):
+        # the tick can't flush this connection while the lock is held
+        with self.send_queue.lock:
+            SetCompression(self).send()
+            LoginSuccess(self).send()
 
-        SetCompression(self).send()
-        LoginSuccess(self).send()
-
-        self.state = States.PLAY
-        JoinGame(self).send()
+            self.state = States.PLAY
+            self.keepalive.start()
+            JoinGame(self).send()
 
-        impl_name = mc_string("{}/{}".format(APP_NAME, APP_VERSION)).bytes()
-        OutgoingPluginMessage(self, "MC|Brand", impl_name).send()
+            impl_name = mc_string("{}/{}".format(APP_NAME, APP_VERSION)).bytes()
+            OutgoingPluginMessage(self, "MC|Brand", impl_name).send()
 
-        self.player.spawn()
+            self.player.spawn()
+            self.spawned = True
 
     def _worker(self):
 
@@ -64,15 +100,16 @@ class MCConnection:
                 pkt = IncomingPacket.from_connection(self)
                 pkt.recv()
 
-            self.keepalive.start()
-
             while True:
                 if self.closed:
                     return
 
-                pkt = IncomingPacket.from_connection(self)
-                pkt.recv()
-                self.keepalive.check()
+                if len(self.inbound) >= self.max_inbound:
+                    # the tick is behind on this connection, stop reading until it catches up
+                    time.sleep(self.server.ticker.interval)
+                    continue
+
+                self.inbound.append(IncomingPacket.from_connection(self))
 
         except IllegalData as e:
             print(e, file=sys.stderr)
@@ -85,12 +122,58 @@ class MCConnection:
         finally:
             self.close()
 
+    def backlog(self):
+        return self.send_queue.backlog()
+
+    def flush(self, wait=False):
+        self.send_queue.flush(wait)
+
+        # a peer that doesn't read what it is sent is dropped before it piles up
+        if self.backlog() <= self.max_backlog:
+            self.backlogged = None
+        elif self.backlogged is None:
+            self.backlogged = time.monotonic()
+        elif time.monotonic() - self.backlogged > self.backlog_timeout:
+            raise ProtocolError("send backlog over {} bytes for {} s".format(
+                self.max_backlog, self.backlog_timeout))
+
+    def call_soon(self, callback, *args):
+        # runs callback on the server tick, where it is safe to send to this connection
+        self.server.ticker.call_soon(self._call, callback, *args)
+
+    def _call(self, callback, *args):
+        with self.send_queue.lock:
+            if self.closed:
+                return
+
+            try:
+                callback(*args)
+                self.flush()
+            except ProtocolError as e:
+                print(e, file=sys.stderr)
+                self.close()
+
     def close(self):
         if not self.closed:
             self.closed = True
+            self.keepalive.stop()
+            try:
+                # sends what the socket takes now, a stalled peer loses the rest
+                self.send_queue.flush(wait=True)
+            except ProtocolError:
+                pass
+
             self.server.connections = [s for s in self.server.connections if s]
             self.server.players = [p for p in self.server.players if p]
+            self.server.update_status()
+            if self.player is not None:
+                self.server.world.unpin_chunks(self.player)
             print("term <{}:{}>: ({} left)".format(self.addr[0], self.addr[1], len(self.server.connections)))
+            try:
+                # wakes a worker blocked in recv on another thread
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
             self._sock.close()
 
     def __bool__(self):
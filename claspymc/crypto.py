@@ -32,11 +32,20 @@ def decrypt_with_private_key(private_key, encrypted_payload):
 
 class CryptoSocket:
 
+    # AES/CFB8 keeps the length of the data, but update_into wants a block
+    # less a byte of room past it in the output, and the input and output
+    # must not overlap. Outgoing batches are joined and encrypted with one
+    # call into a buffer that is reused, incoming data is decrypted straight
+    # into the caller's buffer.
+
+    SLACK = 15
     def __init__(self, sock):
         self.sock = sock
         self.cipher = None
         self.encryptor = None
         self.decryptor = None
+        self.encrypted = bytearray()
+        self.received = bytearray()
 
     def init_cipher(self, cipher):
         self.cipher = cipher
@@ -46,26 +55,76 @@ class CryptoSocket:
     def __getattr__(self, item):
         return getattr(self.sock, item, None)
 
-    def recv(self, bufsize, flags=0):
+    @staticmethod
+    def _scratch(buf, size):
+        if len(buf) >= size:
+            return buf
+        return bytearray(max(size, 2*len(buf)))
+
+    def encrypt(self, buffers):
+        # the ciphertext is only valid until the next call
+        plain = buffers[0] if len(buffers) == 1 else b''.join(buffers)
+        self.encrypted = self._scratch(self.encrypted, len(plain) + self.SLACK)
+        n = self.encryptor.update_into(plain, self.encrypted)
+        return memoryview(self.encrypted)[:n]
+
+    def wire(self, buffers):
+        # what goes on the wire for buffers, encrypted ones only until the next call
+        if not self.cipher:
+            return buffers
+        return (self.encrypt(buffers),)
+
+    def decrypt(self, buf):
         if not self.cipher:
-            return self.sock.recv(bufsize, flags)
+            return buf
 
-        buf = self.sock.recv(bufsize, flags)
         return self.decryptor.update(buf)
 
+    def decrypt_into(self, data, out):
+        # out needs SLACK bytes more than data and must not overlap it
+        return self.decryptor.update_into(data, out)
+
+    def decrypt_in_place(self, buf):
+        self.received = self._scratch(self.received, len(buf) + self.SLACK)
+        n = self.decryptor.update_into(buf, self.received)
+        buf[:n] = memoryview(self.received)[:n]
+
+    def recv(self, bufsize, flags=0):
+        return self.decrypt(self.sock.recv(bufsize, flags))
+
+    def recv_into(self, buf, nbytes=0, flags=0):
+        if not self.cipher:
+            return self.sock.recv_into(buf, nbytes, flags)
+
+        # reads at most SLACK bytes less than buf has room for
+        size = min(nbytes or len(buf), len(buf) - self.SLACK)
+        self.received = self._scratch(self.received, size)
+        n = self.sock.recv_into(self.received, size, flags)
+        if not n:
+            return 0
+        return self.decrypt_into(memoryview(self.received)[:n], buf)
+
     def send(self, buf, flags=0):
         if not self.cipher:
             return self.sock.send(buf, flags)
 
-        payload = self.encryptor.update(buf)
-        return self.sock.send(payload, flags)
+        # the cipher state has already advanced, so everything must go out
+        self.sock.sendall(self.encrypt((buf,)), flags)
+        return len(buf)
+
+    def sendmsg(self, buffers, *args):
+        if not self.cipher:
+            return self.sock.sendmsg(buffers, *args)
+
+        payload = self.encrypt(buffers)
+        self.sock.sendall(payload)
+        return len(payload)
 
     def sendall(self, buf, flags=0):
         if not self.cipher:
             return self.sock.sendall(buf, flags)
 
-        payload = self.encryptor.update(buf)
-        return self.sock.send(payload, flags)
+        self.sock.sendall(self.encrypt((buf,)), flags)
 
 class CryptoState:
 
@@ -86,6 +145,9 @@ class CryptoState:
         return self.private_key.decrypt(payload, pkcs_padding)
 
     def init_aes(self, shared_secret):
+        # anything queued so far was meant to go out unencrypted
+        self.connection.flush(wait=True)
+
         self.aes_cipher = Cipher(
             algorithms.AES(shared_secret),
             modes.CFB8(shared_secret),
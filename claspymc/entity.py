@@ -24,6 +24,7 @@ particle_id = _running_id()
 
 class Entity(mc_comp):
 
+    __slots__ = ("entity_id",)
     id = mc_field("id", mc_string)
     position = mc_field("Pos", mc_vec3f)
     velocity = mc_field("Motion", mc_vec3f)
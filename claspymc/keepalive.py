@@ -1,68 +1,90 @@
 #!/usr/bin/env python3
 
-import threading
+import sys
 import time
-from random import randint
+from random import getrandbits
 
-from .net import ProtocolError
-from .packet import OutgoingKeepAlive
-
-from claspymc.util import *
+from .packet import OutgoingKeepAlive, Disconnect
 
 __author__ = 'Thomas Bell'
 
-class Heartbeat:
-
-    def __init__(self, conn, token):
-        self.id = token
-        self.sent = None
-        self.connection = conn
-        self.packet = OutgoingKeepAlive(self.connection, self.id)
-
-    def send(self):
-        self.sent = time.time()
-        self.packet.send()
-
 class KeepAlive:
 
+    # Per connection keepalive state. Sends and timeouts are timers on the
+    # server tick, so there is no thread per connection and nothing to scan
+    # when packets arrive. Outstanding tokens map to their send time and
+    # timeout timer.
+
+    SEND_INTERVAL = 10
+    TIMEOUT = 30
     def __init__(self, conn):
         self.server = conn.server
         self.connection = conn
-        self.sock = conn.sock
         self.config = conn.config.get("keepalive", {})
-        self.heartbeats = []
-
-        self.thread = threading.Thread(target=self._worker)
+        self.tokens = {}
+        self.send_timer = None
+        self.started = False
 
-    def callback(self, token):
-        for beat in self.heartbeats:
-            if beat.id == token:
-                self.heartbeats.remove(beat)
+        self.rtt = None
+        self.rtt_min = None
+        self.rtt_avg = None
+        self.samples = 0
 
-        res = OutgoingKeepAlive(self.connection, token)
-        res.send()
-
-    def check(self):
-        for beat in self.heartbeats:
-            if beat.sent and time.time() - beat.sent > self.config.get("timeout", 30):
-                raise ProtocolError("Player timed out")
-
-    def _worker(self):
-        try:
-            while True:
-                if not self.connection or not self.server:
-                    break
-
-                self.send()
-                time.sleep(self.config.get("send_interval", 10))
-
-        finally:
-            self.connection.close()
+    def start(self):
+        # safe from any thread, the timers are set up on the tick
+        if not self.started:
+            self.started = True
+            self.server.ticker.call_soon(self._schedule_send)
+
+    def stop(self):
+        if self.send_timer is not None:
+            self.send_timer.cancel()
+        tokens, self.tokens = self.tokens, {}
+        for sent, timer in tokens.values():
+            timer.cancel()
+
+    def _schedule(self, seconds, callback, *args):
+        ticker = self.server.ticker
+        return ticker.schedule(ticker.seconds(seconds), self.connection._call, callback, *args)
+
+    def _schedule_send(self):
+        if self.connection:
+            self.send_timer = self._schedule(self.config.get("send_interval", self.SEND_INTERVAL), self.send)
 
     def send(self):
-        heartbeat = Heartbeat(self.connection, randint(0, 127))
-        heartbeat.send()
-        self.heartbeats.append(heartbeat)
-
-    def start(self):
-        self.thread.start()
+        token = getrandbits(31)
+        while token in self.tokens:
+            token = getrandbits(31)
+
+        timer = self._schedule(self.config.get("timeout", self.TIMEOUT), self._expire, token)
+        self.tokens[token] = (time.monotonic(), timer)
+        OutgoingKeepAlive(self.connection, token).send()
+        self._schedule_send()
+
+    def _expire(self, token):
+        if token in self.tokens:
+            print("{} timed out".format(self.connection.addr), file=sys.stderr)
+            self.stop()
+            Disconnect(self.connection, "Timed out").send()
+
+    def callback(self, token, received=None):
+        entry = self.tokens.pop(token, None)
+        if entry is None:
+            return
+
+        sent, timer = entry
+        timer.cancel()
+        rtt = (received or time.monotonic()) - sent
+        self.rtt = rtt
+        self.rtt_min = rtt if self.rtt_min is None else min(self.rtt_min, rtt)
+        self.rtt_avg = rtt if self.rtt_avg is None else self.rtt_avg + (rtt - self.rtt_avg) / 8
+        self.samples += 1
+
+    def stats(self):
+        return {
+            "rtt_ms": None if self.rtt is None else 1000*self.rtt,
+            "rtt_min_ms": None if self.rtt_min is None else 1000*self.rtt_min,
+            "rtt_avg_ms": None if self.rtt_avg is None else 1000*self.rtt_avg,
+            "samples": self.samples,
+            "outstanding": len(self.tokens)
+        }
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import math
+import time
+import asyncio
+import argparse
+import resource
+import subprocess
+from io import BytesIO
+
+from .client import AsyncClient
+from .net import ProtocolError
+from .packet import \
+    PacketLayout, ChunkData, UnloadChunk, OutgoingPlayerPositionLook, \
+    IncomingPlayerPosition, TeleportConfirm, ClientSettings
+from .types import mc_int, mc_double, mc_float, mc_sbyte, mc_ubyte, mc_bool, mc_varint, mc_string
+
+__author__ = 'Thomas Bell'
+
+# Headless bots for finding how many players the server holds: each one logs
+# in offline, accepts chunks, answers keepalives and walks in a straight line
+# sending position updates. Chunk latency is measured from the moment a chunk
+# comes into the bot's view (or from login for the initial view) until its
+# ChunkData arrives.
+
+POSITION = PacketLayout(IncomingPlayerPosition.packet_id, mc_double, mc_double, mc_double, mc_bool)
+TELEPORT_CONFIRM = PacketLayout(TeleportConfirm.packet_id, mc_varint)
+CLIENT_SETTINGS = PacketLayout(ClientSettings.packet_id, mc_string, mc_ubyte, mc_varint, mc_bool, mc_ubyte, mc_varint)
+
+class Bot(AsyncClient):
+
+    def __init__(self, host, port, username, view_distance=8):
+        super().__init__(host, port, username)
+        self.view_distance = view_distance
+        self.position = None
+        self.logged_in = None
+        self.needed = {}
+        self.chunks = set()
+        self.chunk_latency = []
+        self.connect_latency = None
+        self.login_latency = None
+
+    async def start(self):
+        started = time.perf_counter()
+        await self.connect()
+        self.connect_latency = time.perf_counter() - started
+        await self.login()
+        self.logged_in = time.perf_counter()
+        self.login_latency = self.logged_in - started
+
+        # locale, view distance, chat mode, chat colours, skin parts, main hand
+        self.send_body(CLIENT_SETTINGS.pack("en_US", self.view_distance, 0, True, 0x7F, 1))
+        await self.writer.drain()
+
+    def _view(self):
+        x, z = int(math.floor(self.position[0])) >> 4, int(math.floor(self.position[2])) >> 4
+        r = self.view_distance
+        return ((cx, cz) for cx in range(x - r, x + r + 1) for cz in range(z - r, z + r + 1))
+
+    def _look_around(self):
+        # chunks that left the view before they arrived are no longer owed
+        now = time.perf_counter()
+        view = set(self._view())
+        for key in [key for key in self.needed if key not in view]:
+            del self.needed[key]
+
+        for key in view:
+            if key not in self.chunks and key not in self.needed:
+                self.needed[key] = now
+
+    def handle(self, packet_id, payload):
+        if packet_id == ChunkData.packet_id:
+            fp = BytesIO(payload)
+            key = (mc_int.read(fp), mc_int.read(fp))
+            self.chunks.add(key)
+            self.chunk_latency.append(time.perf_counter() - self.needed.pop(key, self.logged_in))
+
+        elif packet_id == UnloadChunk.packet_id:
+            fp = BytesIO(payload)
+            self.chunks.discard((mc_int.read(fp), mc_int.read(fp)))
+
+        elif packet_id == OutgoingPlayerPositionLook.packet_id:
+            fp = BytesIO(payload)
+            self.position = [mc_double.read(fp), mc_double.read(fp), mc_double.read(fp)]
+            mc_float.read(fp), mc_float.read(fp), mc_sbyte.read(fp)
+            teleport_id = mc_varint.read(fp)
+            self.send_body(TELEPORT_CONFIRM.pack(teleport_id))
+            self._look_around()
+
+    async def receive(self):
+        while True:
+            self.handle(*await self.read_packet())
+
+    async def walk(self, rate, speed, duration):
+        # moves along +x at speed blocks per second, rate updates per second
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            await asyncio.sleep(1 / rate)
+            if self.position is None:
+                continue
+
+            self.position[0] += speed / rate
+            self.send_body(POSITION.pack(*self.position, True))
+            await self.writer.drain()
+            self._look_around()
+
+class ServerCPU:
+
+    # cumulative user+system time of a server process, read from /proc
+    def __init__(self, pid):
+        self.pid = pid
+        self.tick = os.sysconf("SC_CLK_TCK")
+
+    def seconds(self):
+        try:
+            with open("/proc/{}/stat".format(self.pid)) as f:
+                stat = f.read()
+        except OSError:
+            return None
+
+        fields = stat[stat.rindex(")") + 2:].split()
+        return (int(fields[11]) + int(fields[12])) / self.tick
+
+def percentiles(values, points=(50, 90, 99)):
+    values = sorted(values)
+    if not values:
+        return {p: None for p in points}
+    return {p: values[min(len(values) - 1, int(math.ceil(p / 100 * len(values))) - 1)] for p in points}
+
+def _ms(seconds):
+    return {p: None if v is None else 1000*v for p, v in percentiles(seconds).items()}
+
+async def run_bot(bot, rate, speed, duration, results):
+    receiver = None
+    try:
+        await bot.start()
+        receiver = asyncio.ensure_future(bot.receive())
+        await bot.walk(rate, speed, duration)
+        if receiver.done():
+            receiver.result()
+        results.append(bot)
+
+    except (ProtocolError, ConnectionError, OSError) as e:
+        print("{}: {}".format(bot.username, e), file=sys.stderr)
+
+    finally:
+        if receiver is not None:
+            receiver.cancel()
+        bot.close()
+
+async def wait_for_server(host, port, timeout=15):
+    end = time.perf_counter() + timeout
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.perf_counter() > end:
+                raise
+            await asyncio.sleep(0.1)
+
+async def load(args):
+    await wait_for_server(args.host, args.port)
+    cpu = ServerCPU(args.pid) if args.pid else None
+    cpu_start = cpu.seconds() if cpu else None
+    started = time.perf_counter()
+
+    results = []
+    tasks = []
+    for i in range(args.clients):
+        bot = Bot(args.host, args.port, "{}{}".format(args.prefix, i), args.view_distance)
+        tasks.append(asyncio.ensure_future(run_bot(bot, args.rate, args.speed, args.duration, results)))
+        if args.ramp:
+            await asyncio.sleep(args.ramp)
+
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    cpu_end = cpu.seconds() if cpu else None
+
+    report = {
+        "clients": args.clients,
+        "connected": len(results),
+        "seconds": elapsed,
+        "connect_ms": _ms([b.connect_latency for b in results]),
+        "login_ms": _ms([b.login_latency for b in results]),
+        "chunk_ms": _ms([t for b in results for t in b.chunk_latency]),
+        "chunks": sum(len(b.chunk_latency) for b in results),
+        "chunks_missing": sum(len(b.needed) for b in results),
+        "recv_bytes": sum(b.recv_bytes for b in results),
+        "sent_packets": sum(b.sent_packets for b in results)
+    }
+    if cpu_start is not None and cpu_end is not None:
+        report["server_cpu_s"] = cpu_end - cpu_start
+        report["server_cpu_pct"] = 100 * (cpu_end - cpu_start) / elapsed
+
+    return report
+
+def print_report(report):
+    print("{} of {} clients connected, {:.1f}s".format(report["connected"], report["clients"], report["seconds"]))
+    for name in ("connect_ms", "login_ms", "chunk_ms"):
+        values = report[name]
+        print("{: <10} {}".format(name[:-3], "  ".join(
+            "p{}={}".format(p, "-" if v is None else "{:.1f}ms".format(v)) for p, v in values.items())))
+    print("chunks     {} received, {} never arrived, {} bytes".format(
+        report["chunks"], report["chunks_missing"], report["recv_bytes"]))
+    if "server_cpu_s" in report:
+        print("server cpu {:.2f}s ({:.0f}%)".format(report["server_cpu_s"], report["server_cpu_pct"]))
+
+def main():
+    parser = argparse.ArgumentParser(description="Open headless bot clients against a server.")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=25565)
+    parser.add_argument("-n", "--clients", type=int, default=10)
+    parser.add_argument("--ramp", type=float, default=0.05, help="Seconds between connects.")
+    parser.add_argument("-d", "--duration", type=float, default=30.0, help="Seconds each bot walks.")
+    parser.add_argument("-r", "--rate", type=float, default=20.0, help="Position updates per second.")
+    parser.add_argument("--speed", type=float, default=4.3, help="Walking speed in blocks per second.")
+    parser.add_argument("--view-distance", type=int, default=8)
+    parser.add_argument("--prefix", default="bot")
+    parser.add_argument("--pid", type=int, default=None, help="Server process to report CPU time for.")
+    parser.add_argument("--spawn", default=None, metavar="CONFIG",
+                        help="Start 'python -m claspymc -c CONFIG' for the run.")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    args = parser.parse_args()
+
+    server = None
+    if args.spawn:
+        server = subprocess.Popen([sys.executable, "-m", "claspymc", "-c", args.spawn],
+                                  stdout=subprocess.DEVNULL)
+        args.pid = server.pid
+
+    try:
+        report = asyncio.run(load(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if server is not None and "server_cpu_s" not in report:
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        report["server_cpu_s"] = usage.ru_utime + usage.ru_stime
+        report["server_cpu_pct"] = 100 * report["server_cpu_s"] / report["seconds"]
+
+    if args.json:
+        print(json.dumps(report, indent=4))
+    else:
+        print_report(report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+import struct
+
+from nbt import nbt
+
+from .types import mc_comp, mc_list_field
+
+__author__ = 'Thomas Bell'
+
+TAG_END = 0
+TAG_BYTE = 1
+TAG_SHORT = 2
+TAG_INT = 3
+TAG_LONG = 4
+TAG_FLOAT = 5
+TAG_DOUBLE = 6
+TAG_BYTE_ARRAY = 7
+TAG_STRING = 8
+TAG_LIST = 9
+TAG_COMPOUND = 10
+TAG_INT_ARRAY = 11
+TAG_LONG_ARRAY = 12
+
+_ushort = struct.Struct(">H")
+_int = struct.Struct(">i")
+
+NUMERIC = {
+    TAG_BYTE: (nbt.TAG_Byte, struct.Struct(">b")),
+    TAG_SHORT: (nbt.TAG_Short, struct.Struct(">h")),
+    TAG_INT: (nbt.TAG_Int, _int),
+    TAG_LONG: (nbt.TAG_Long, struct.Struct(">q")),
+    TAG_FLOAT: (nbt.TAG_Float, struct.Struct(">f")),
+    TAG_DOUBLE: (nbt.TAG_Double, struct.Struct(">d"))
+}
+
+FIXED_SIZE = {tag_id: fmt.size for tag_id, (_, fmt) in NUMERIC.items()}
+
+ARRAY_SIZE = {
+    TAG_BYTE_ARRAY: 1,
+    TAG_INT_ARRAY: 4,
+    TAG_LONG_ARRAY: 8
+}
+
+class MalformedNBT(ValueError):
+    pass
+
+_schemas = {}
+
+def schema_of(cls):
+    # maps the nbt keys an mc_comp class declares to the schema of their
+    # children, None keeps a subtree whole. A bare mc_comp declares nothing,
+    # so e.g. tile entities come out as empty compounds.
+    if cls in _schemas:
+        return _schemas[cls]
+
+    schema = {}
+    _schemas[cls] = schema  # registered before recursing for recursive fields
+    for field in cls._fields:
+        if field.recursive:
+            child = cls
+        elif isinstance(field, mc_list_field):
+            child = field.item_type
+        else:
+            child = field.container
+
+        schema[field.key] = schema_of(child) if issubclass(child, mc_comp) else None
+
+    return schema
+
+class NBTReader:
+
+    # Compounds that lost tags to the schema, or have a descendant that did,
+    # are marked partial, and mc_comp.to_nbt() refuses to write them back.
+
+    def __init__(self, data):
+        self.view = memoryview(data)
+        self.offset = 0
+        self.skipped = 0
+
+    def _take(self, length):
+        start = self.offset
+        end = start + length
+        if length < 0 or end > len(self.view):
+            raise MalformedNBT("truncated NBT data at offset {}".format(start))
+
+        self.offset = end
+        return self.view[start:end]
+
+    def _byte(self):
+        try:
+            value = self.view[self.offset]
+        except IndexError:
+            raise MalformedNBT("truncated NBT data at offset {}".format(self.offset))
+
+        self.offset += 1
+        return value
+
+    def _unpack(self, fmt):
+        try:
+            (value,) = fmt.unpack_from(self.view, self.offset)
+        except struct.error:
+            raise MalformedNBT("truncated NBT data at offset {}".format(self.offset))
+
+        self.offset += fmt.size
+        return value
+
+    def _string(self):
+        data = self._take(self._unpack(_ushort))
+        try:
+            return str(data, "utf8")
+        except UnicodeDecodeError as e:
+            raise MalformedNBT(e)
+
+    def read_root(self, schema=None):
+        if self._byte() != TAG_COMPOUND:
+            raise MalformedNBT("NBT root must be a TAG_Compound")
+
+        return self._compound(self._string(), schema)
+
+    def _payload(self, tag_id, name, schema):
+        if tag_id in NUMERIC:
+            tag_cls, fmt = NUMERIC[tag_id]
+            return tag_cls(self._unpack(fmt), name)
+
+        elif tag_id == TAG_BYTE_ARRAY:
+            tag = nbt.TAG_Byte_Array(name=name)
+            tag.value = self._take(self._unpack(_int))  # zero-copy slice of the input
+            return tag
+
+        elif tag_id == TAG_STRING:
+            return nbt.TAG_String(self._string(), name)
+
+        elif tag_id == TAG_LIST:
+            return self._list(name, schema)
+
+        elif tag_id == TAG_COMPOUND:
+            return self._compound(name, schema)
+
+        elif tag_id == TAG_INT_ARRAY or tag_id == TAG_LONG_ARRAY:
+            tag = nbt.TAGLIST[tag_id](name=name)
+            length = self._unpack(_int)
+            data = self._take(length * ARRAY_SIZE[tag_id])
+            tag.value = list(struct.unpack(">{}{}".format(length, "i" if tag_id == TAG_INT_ARRAY else "q"), data))
+            return tag
+
+        else:
+            raise MalformedNBT("invalid NBT tag id {}".format(tag_id))
+
+    def _list(self, name, schema):
+        item_id = self._byte()
+        length = self._unpack(_int)
+        if item_id not in nbt.TAGLIST:
+            raise MalformedNBT("invalid NBT list type {}".format(item_id))
+
+        tag = nbt.TAG_List(type=nbt.TAGLIST[item_id], name=name)
+        for i in range(length):
+            tag.tags.append(self._payload(item_id, None, schema))
+
+        return tag
+
+    def _compound(self, name, schema):
+        tag = nbt.TAG_Compound(name=name)
+        skipped = self.skipped
+        while True:
+            tag_id = self._byte()
+            if tag_id == TAG_END:
+                break
+
+            child = self._string()
+            if schema is None:
+                tag.tags.append(self._payload(tag_id, child, None))
+            elif child in schema:
+                tag.tags.append(self._payload(tag_id, child, schema[child]))
+            else:
+                self.skip(tag_id)
+                self.skipped += 1
+
+        if self.skipped > skipped:
+            tag.partial = True
+        return tag
+
+    def skip(self, tag_id):
+        # walks over a payload without building any tags
+        if tag_id in FIXED_SIZE:
+            self._take(FIXED_SIZE[tag_id])
+
+        elif tag_id in ARRAY_SIZE:
+            self._take(self._unpack(_int) * ARRAY_SIZE[tag_id])
+
+        elif tag_id == TAG_STRING:
+            self._take(self._unpack(_ushort))
+
+        elif tag_id == TAG_LIST:
+            item_id = self._byte()
+            length = self._unpack(_int)
+            if item_id in FIXED_SIZE:
+                self._take(length * FIXED_SIZE[item_id])
+            elif length > 0:
+                for i in range(length):
+                    self.skip(item_id)
+
+        elif tag_id == TAG_COMPOUND:
+            while True:
+                child_id = self._byte()
+                if child_id == TAG_END:
+                    break
+                self._take(self._unpack(_ushort))
+                self.skip(child_id)
+
+        else:
+            raise MalformedNBT("invalid NBT tag id {}".format(tag_id))
+
+def read(data, schema=None):
+    # schema is an mc_comp class, keys it doesn't declare are skipped
+    if isinstance(schema, type):
+        schema = schema_of(schema)
+
+    return NBTReader(data).read_root(schema)
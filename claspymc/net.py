@@ -2,6 +2,11 @@
 
 import sys
 import socket
+import select
+import threading
+from concurrent.futures import Future
+
+from . import varint
 
 __author__ = 'Thomas Bell'
 
@@ -43,3 +48,259 @@ def safe_send(sock, buf):
         print(e, file=sys.stderr)
         raise ProtocolError(e)
 
+IOV_MAX = 1024
+def _consume(buffers, sent):
+    while sent:
+        if sent >= len(buffers[0]):
+            sent -= len(buffers.pop(0))
+        else:
+            buffers[0] = buffers[0][sent:]
+            sent = 0
+
+def sendmsg_all(sock, buffers):
+    buffers = [memoryview(b).cast("B") for b in buffers if len(b)]
+    while buffers:
+        _consume(buffers, sock.sendmsg(buffers[:IOV_MAX]))
+
+def sendmsg_some(sock, buffers):
+    # sends as much as the socket has room for without waiting and returns
+    # the buffers that are left. A socket with a timeout waits for room even
+    # with MSG_DONTWAIT, so it is polled first.
+    if sock.fileno() < 0:
+        raise BrokenPipeError("socket is closed")
+
+    buffers = [memoryview(b).cast("B") for b in buffers if len(b)]
+    while buffers and select.select((), (sock,), (), 0)[1]:
+        try:
+            _consume(buffers, sock.sendmsg(buffers[:IOV_MAX]))
+        except (BlockingIOError, InterruptedError):
+            break
+    return buffers
+
+def read_frame_header(buf, offset=0):
+    # returns (frame length, frame offset), or None if the prefix is incomplete
+    try:
+        return varint.decode(buf, offset)
+    except IndexError:
+        return None
+    except ValueError:
+        raise IllegalData("Frame length prefix too long")
+
+class RecvBuffer:
+
+    MAX_FRAME = (1 << 21) - 1
+    READ_SIZE = 16384
+    def __init__(self, sock, size=65536):
+        self.sock = sock
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        self.decrypted = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def _reserve(self, size):
+        if len(self.buffer) - self.end >= size:
+            return
+
+        # compact, and grow if the unread data still doesn't leave enough room
+        unread = self.end - self.start
+        if unread + size > len(self.buffer):
+            buffer = bytearray(max(2*len(self.buffer), unread + size))
+            buffer[:unread] = self.view[self.start:self.end]
+            self.buffer = buffer
+            self.view = memoryview(buffer)
+        else:
+            self.view[:unread] = self.view[self.start:self.end]
+
+        self.decrypted = max(0, self.decrypted - self.start)
+        self.start = 0
+        self.end = unread
+
+    def _direct(self):
+        # with nothing left to decrypt in place, new data can be decrypted on
+        # its way into the buffer
+        return self.sock.cipher is not None and self.decrypted == self.end
+
+    def feed(self, data):
+        if self._direct():
+            self._reserve(len(data) + self.sock.SLACK)
+            self.end += self.sock.decrypt_into(data, self.view[self.end:])
+            self.decrypted = self.end
+            return
+
+        self._reserve(len(data))
+        self.view[self.end:self.end+len(data)] = data
+        self.end += len(data)
+
+    def fill(self):
+        self._reserve(self.READ_SIZE)
+        try:
+            if self._direct():
+                n = self.sock.recv_into(self.view[self.end:])
+                self.decrypted = self.end + n
+            else:
+                # read the raw socket, decryption is deferred until frames are parsed
+                n = self.sock.sock.recv_into(self.view[self.end:])
+        except (BrokenPipeError, OSError, socket.timeout) as e:
+            print(e, file=sys.stderr)
+            raise ProtocolError(e)
+
+        if not n:
+            raise ProtocolError("connection closed")
+
+        self.end += n
+        return n
+
+    def _decrypt(self):
+        # the cipher can be enabled by a packet that shares a read with its successors
+        if self.sock.cipher is not None and self.decrypted < self.end:
+            self.sock.decrypt_in_place(self.view[max(self.start, self.decrypted):self.end])
+            self.decrypted = self.end
+
+    def next_frame(self):
+        self._decrypt()
+        header = read_frame_header(self.view[:self.end], self.start)
+        if header is None:
+            return None
+
+        length, offset = header
+        if length < 0 or length > self.MAX_FRAME:
+            raise IllegalData("Frame too long")
+
+        if offset + length > self.end:
+            self._reserve(offset + length - self.end)
+            return None
+
+        self.start = offset + length
+        return self.view[offset:self.start]
+
+class SendQueue:
+
+    # Frames are queued until flushed and go out in one batch. A queue that
+    # isn't blocking never waits for the socket: what it has no room for is
+    # kept, already encrypted, and goes out first on a later flush. Those
+    # need a CryptoSocket.
+
+    FLUSH_SIZE = 65536
+    def __init__(self, sock, flush_size=None, blocking=True):
+        self.sock = sock
+        self.flush_size = flush_size or self.FLUSH_SIZE
+        self.blocking = blocking
+        self.lock = threading.RLock()
+        self.buffers = []
+        self.size = 0
+        self.futures = 0  # frames still being compressed, resolved on flush
+        self.unsent = []  # wire bytes the socket had no room for yet
+        self.unsent_size = 0
+
+        self.frames = 0
+        self.flushes = 0
+        self.syscalls = 0
+        self.flushed_bytes = 0
+
+    def __len__(self):
+        return self.size + self.futures + self.unsent_size
+
+    def backlog(self):
+        return self.size + self.unsent_size
+
+    def push(self, *parts):
+        with self.lock:
+            for part in parts:
+                if isinstance(part, Future):
+                    self.buffers.append(part)
+                    self.futures += 1
+                elif len(part):
+                    self.buffers.append(part)
+                    self.size += len(part)
+
+            self.frames += 1
+            # queues that don't block are flushed by the tick
+            if self.blocking and self.size >= self.flush_size:
+                self.flush()
+
+    def pending(self):
+        # the first frame still being compressed, if any
+        with self.lock:
+            for part in self.buffers:
+                if isinstance(part, Future) and not part.done():
+                    return part
+            return None
+
+    def _take_ready(self, wait):
+        # the buffers up to the first frame still being compressed, that one
+        # and everything after it wait for a later flush
+        ready = []
+        for part in self.buffers:
+            if isinstance(part, Future):
+                if not (wait or part.done()):
+                    break
+                part = part.result()
+            ready.append(part)
+
+        if not ready:
+            return ready
+
+        self.buffers = self.buffers[len(ready):]
+        self.futures = sum(1 for part in self.buffers if isinstance(part, Future))
+        self.size = sum(len(part) for part in self.buffers if not isinstance(part, Future))
+        return ready
+
+    def _send_some(self, buffers):
+        # the cipher moves past everything here whether it goes out or not,
+        # so the encrypted tail is copied out of the reused buffer
+        wire = self.unsent + list(self.sock.wire(buffers))
+        self.syscalls += 1
+        left = sendmsg_some(self.sock.sock, wire)
+        if left and self.sock.cipher is not None:
+            left = [b''.join(left)]
+
+        self.unsent = left
+        self.unsent_size = sum(len(part) for part in left)
+
+    def flush(self, wait=False):
+        # wait blocks until every queued frame is compressed
+        with self.lock:
+            if not self.buffers and not self.unsent:
+                return
+
+            if self.futures:
+                buffers = self._take_ready(wait)
+                size = sum(len(part) for part in buffers)
+            else:
+                buffers, size = self.buffers, self.size
+                self.buffers = []
+                self.size = 0
+
+            if not buffers and not self.unsent:
+                return
+
+            try:
+                if not self.blocking:
+                    self._send_some(buffers)
+                elif hasattr(self.sock, "sendmsg"):
+                    self.syscalls += (len(buffers) + IOV_MAX - 1) // IOV_MAX
+                    sendmsg_all(self.sock, buffers)
+                else:
+                    self.syscalls += 1
+                    self.sock.sendall(b''.join(buffers))
+
+            except (BrokenPipeError, OSError, socket.timeout) as e:
+                print(e, file=sys.stderr)
+                raise ProtocolError(e)
+
+            self.flushes += 1
+            self.flushed_bytes += size
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "flushes": self.flushes,
+            "syscalls": self.syscalls,
+            "flushed_bytes": self.flushed_bytes,
+            "pending_bytes": self.size,
+            "unsent_bytes": self.unsent_size
+        }
@@ -2,21 +2,23 @@
 
 import json
 import random
+import struct
+import time
 import zlib
+from concurrent.futures import Future
 from io import BytesIO
 
 import numpy as np
 
-from .net import \
-    safe_recv, safe_send, \
-    ProtocolError, IllegalData
-from .util import print_hex_dump
+from . import varint
+from .net import ProtocolError, IllegalData
+from .trace import INBOUND, OUTBOUND
 from .types import \
-    mc_varint, mc_string, mc_nettype, \
+    mc_varint, mc_varnum, mc_string, mc_nettype, \
     mc_ushort, mc_long, mc_bytes, \
     mc_ubyte, mc_int, mc_bool, \
     mc_sbyte, mc_double, mc_float, \
-    mc_vec3f, mc_pos, States, Gamemode, nbt_to_bytes
+    mc_vec3f, mc_pos, States, Gamemode
 
 class IncomingPacket:
 
@@ -35,51 +37,66 @@ class IncomingPacket:
     def read(self, length=None):
         return self.buffer.read(length)
 
+    # packets with blocking set do work in prepare() that can block, like web
+    # requests, and the asyncio engine runs it off the event loop before
+    # recv(). prepare() must not send anything.
+    blocking = False
+    prepared = False
+    def prepare(self):
+        self.prepared = True
+
     def recv(self):
         raise NotImplementedError("incoming packet recv() not implemented")
 
     @staticmethod
     def from_connection(conn):
-        try:
-            packet_length = mc_varint.recv(conn.sock)
+        frame = conn.recv_buffer.next_frame()
+        while frame is None:
+            # responses to everything already buffered go out before blocking
+            conn.flush()
+            conn.recv_buffer.fill()
+            frame = conn.recv_buffer.next_frame()
 
-            if conn.compression < 0:
-                packet_id = mc_varint.recv(conn.sock)
-                length = packet_length - len(packet_id)
-                if length < 0:
-                    raise IllegalData("Invalid data length")
+        return IncomingPacket.from_frame(conn, frame)
+
+    @staticmethod
+    def frame_data(conn, frame):
+        # the packet id and payload of a frame
+        if not frame:
+            raise IllegalData("Invalid data length")
+
+        if conn.compression < 0:
+            return frame
+
+        length, offset = varint.decode(frame)
+        if length == 0:  # no compression
+            return frame[offset:]
+        elif length > 0:
+            if length < conn.compression:
+                raise IllegalData("Packet length invalid for compression")
+
+            return conn.server.compressor.decompress(frame[offset:], length)
+        else:
+            raise IllegalData("Invalid data length")
 
-                buffer = BytesIO(safe_recv(conn.sock, length))
+    @staticmethod
+    def from_frame(conn, frame, data=None):
+        # data is the already decompressed frame, if it was done elsewhere
+        if conn.capture is not None:
+            conn.capture.record(conn, INBOUND, frame)
 
-            else:
-                length = mc_varint.recv(conn.sock)
-                if length == 0:  # no compression
-                    packet_id = mc_varint.recv(conn.sock)
-                    buffer_length = packet_length - (len(length) + len(packet_id))
-                    if buffer_length < 0:
-                        raise IllegalData("Invalid data length")
-
-                    buffer = BytesIO(safe_recv(conn.sock, buffer_length))
-                elif length > 0:
-                    if length < conn.compression:
-                        raise IllegalData("Packet length invalid for compression")
-
-                    compress_length = packet_length - len(length)
-                    if compress_length <= 0:  # if == 0, packet_id does not exist
-                        raise IllegalData("Invalid compressed data length")
-
-                    full_msg = BytesIO(zlib.decompress(safe_recv(conn.sock, compress_length)))
-                    packet_id = mc_varint.recv(full_msg)
-                    buffer = BytesIO(full_msg.read())
-                else:
-                    raise IllegalData("Invalid data length")
-
-        except (zlib.error, IllegalData) as e:
+        try:
+            if data is None:
+                data = IncomingPacket.frame_data(conn, frame)
+
+            packet_id, offset = varint.decode(data)
+            buffer = BytesIO(data[offset:])
+
+        except (zlib.error, IndexError, ValueError, IllegalData) as e:
             raise IllegalData("Incoming packet format invalid: {}".format(str(e)))
 
-        if packet_id != IncomingKeepAlive.packet_id or conn.state != States.PLAY:
-            print("RECV PACKET (length={}, id={}, state={})".format(length, packet_id, conn.state))
-            print_hex_dump(buffer.getvalue())
+        if conn.tracer.enabled:
+            conn.tracer.record(conn, INBOUND, packet_id, data[offset:])
 
         if conn.state == States.HANDSHAKING:
             if packet_id == 0x00:
@@ -103,9 +120,94 @@ class IncomingPacket:
         return UnknownPacket(conn, buffer)
 
 
+class PacketLayout:
+
+    def __init__(self, packet_id, *fields):
+        # runs of fixed-width fields are packed by a single struct, variable-width
+        # fields (varints, strings, ...) are encoded in between. pack() is
+        # generated per layout.
+        self.header = varint.encode(packet_id)
+        self.fields = fields
+
+        env = {
+            "HEADER": self.header,
+            "ProtocolError": ProtocolError,
+            "struct": struct,
+            "encode_into": varint.encode_into,
+            "varint_size": varint.size
+        }
+        args = ["v{}".format(i) for i in range(len(fields))]
+        encode = []
+        body = []
+        offset = str(len(self.header))
+        size = [str(len(self.header))]
+        run = []
+
+        def flush_run():
+            if not run:
+                return offset
+            fmt = struct.Struct("!" + "".join(fields[i].format.lstrip("!") for i in run))
+            env["s{}".format(run[0])] = fmt
+            body.append("        s{}.pack_into(buf, {}, {})".format(
+                run[0], offset, ", ".join(args[i] for i in run)))
+            size.append(str(fmt.size))
+            run.clear()
+            return "{} + {}".format(offset, fmt.size) if offset != "0" else str(fmt.size)
+
+        for i, field in enumerate(fields):
+            if field.format:
+                run.append(i)
+                continue
+
+            offset = flush_run()
+            if offset != "o":
+                body.append("        o = {}".format(offset))
+            offset = "o"
+
+            if issubclass(field, mc_varnum):  # written straight into the buffer
+                size.append("varint_size(v{}, {})".format(i, field._width))
+                body.append("        o = encode_into(buf, o, v{}, {})".format(i, field._width))
+                continue
+
+            if field is mc_string:
+                encode.append("    p{0} = str(v{0}).encode('utf8')".format(i))
+            elif field is mc_bytes:
+                encode.append("    p{0} = v{0}".format(i))
+            else:
+                env["t{}".format(i)] = field
+                encode.append("    p{0} = t{0}(v{0}).bytes()".format(i))
+                size.append("len(p{})".format(i))
+                body.append("        buf[o:o + len(p{0})] = p{0}".format(i))
+                body.append("        o += len(p{})".format(i))
+                continue
+
+            # length prefixed
+            size.append("varint_size(len(p{0})) + len(p{0})".format(i))
+            body.append("        o = encode_into(buf, o, len(p{}))".format(i))
+            body.append("        buf[o:o + len(p{0})] = p{0}".format(i))
+            body.append("        o += len(p{})".format(i))
+
+        flush_run()
+        lines = ["def pack({}):".format(", ".join(args))]
+        lines += encode
+        lines += [
+            "    buf = bytearray({})".format(" + ".join(size)),
+            "    buf[:{}] = HEADER".format(len(self.header)),
+            "    try:"
+        ]
+        lines += body or ["        pass"]
+        lines += [
+            "    except struct.error as e:",
+            "        raise ProtocolError('invalid packet field value: {}'.format(e))",
+            "    return buf"
+        ]
+        exec("\n".join(lines), env)
+        self.pack = env["pack"]
+
 class OutgoingPacket:
 
     packet_id = -1
+    layout = None
     def __init__(self, conn):
         self.server = conn.server
         self.sock = conn.sock
@@ -113,36 +215,47 @@ class OutgoingPacket:
         self.config = conn.config
         self.player = conn.player
 
-    def _send(self, payload):
-        if type(payload) is str:
-            payload = mc_string(payload).bytes()
-        elif isinstance(payload, mc_nettype):
-            payload = payload.bytes()
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.layout is not None:
+            cls._packer = PacketLayout(cls.packet_id, *cls.layout)
 
-        orig_payload = payload
-
-        pid = mc_varint(self.packet_id)
-        payload = pid.bytes() + payload
-        length = mc_varint(len(payload))
+    def _frame(self, payload):
+        return self._frame_body(varint.encode(self.packet_id) + payload)
 
+    def _frame_body(self, body):
+        # body is the packet id followed by the payload. Returns the parts of
+        # the frame, big compressed frames are a single future.
         if self.connection.compression < 0:
-            length.send(self.sock)
-            safe_send(self.sock, payload)
+            return varint.encode(len(body)), body
+        elif len(body) >= self.connection.compression:
+            return self.server.compressor.frame(body, self.packet_id)
         else:
-            if len(payload) >= self.connection.compression:
-                payload = zlib.compress(payload)
-            else:
-                length = mc_varint(0)
+            length = varint.encode(0)
+            return varint.encode(len(body) + len(length)) + length, body
 
-            packet_length = mc_varint(len(payload) + len(length))
+    def _send_frame(self, *parts):
+        self.connection.send_queue.push(*parts)
+        if self.connection.capture is not None:
+            self.connection.capture.record_sent(self.connection, parts)
+
+    def _send(self, payload):
+        if type(payload) is str:
+            payload = mc_string(payload).bytes()
+        elif isinstance(payload, mc_nettype):
+            payload = payload.bytes()
 
-            packet_length.send(self.sock)
-            length.send(self.sock)
-            safe_send(self.sock, payload)
+        self._send_frame(*self._frame(payload))
+        if self.connection.tracer.enabled:
+            self.connection.tracer.record(self.connection, OUTBOUND, self.packet_id, payload)
 
-        if pid != OutgoingKeepAlive.packet_id:
-            print("SENT PACKET (length={}, id={}, state={})".format(length, pid, self.connection.state))
-            print_hex_dump(orig_payload)
+    def _send_fields(self, *values):
+        # packs the values according to the class layout
+        body = self._packer.pack(*values)
+        self._send_frame(*self._frame_body(body))
+        if self.connection.tracer.enabled:
+            self.connection.tracer.record(self.connection, OUTBOUND, self.packet_id,
+                                          memoryview(body)[len(self._packer.header):])
 
     def send(self):
         raise NotImplementedError("outgoing packet send() not implemented")
@@ -151,7 +264,7 @@ class UnknownPacket(IncomingPacket):
 
     def recv(self):
         # raise ProtocolError("unknown packet")
-        print("UNHANDLED")
+        pass
 
 class HandshakePacket(IncomingPacket):
 
@@ -177,8 +290,9 @@ class RequestPacket(IncomingPacket):
 class ResponsePacket(OutgoingPacket):
 
     packet_id = 0
+    layout = (mc_string,)
     def send(self):
-        self._send(json.dumps(self.server.response_data()))
+        self._send_fields(json.dumps(self.server.response_data()))
 
 class PingPacket(IncomingPacket):
 
@@ -191,21 +305,29 @@ class PingPacket(IncomingPacket):
 class PongPacket(OutgoingPacket):
 
     packet_id = 1
+    layout = (mc_long,)
     def __init__(self, conn, payload):
         super().__init__(conn)
         self.payload = payload
 
     def send(self):
-        self._send(self.payload)
+        self._send_fields(self.payload)
 
 class LoginStart(IncomingPacket):
 
     packet_id = 0
+    blocking = True
+    def prepare(self):
+        self.username = mc_string.read(self)
+        self.uuid = self.connection.lookup_uuid(self.username)
+        self.prepared = True
+
     def recv(self):
         print("login packet")
-        username = mc_string.read(self)
+        if not self.prepared:
+            self.prepare()
 
-        self.connection.assign_player(username)
+        self.connection.assign_player(self.username, self.uuid)
 
         if self.config.get("online", False):
             res = EncryptionRequest(self.connection)
@@ -217,48 +339,60 @@ class LoginStart(IncomingPacket):
 class EncryptionRequest(OutgoingPacket):
 
     packet_id = 1
+    layout = (mc_string, mc_bytes, mc_bytes)
     def send(self):
         print("making encryption request")
 
         public_key = self.connection.crypto.get_encrypted_key_info()
         verify_token = self.connection.crypto.verify_token
 
-        payload = mc_string("").bytes()
-        payload += mc_bytes(public_key).bytes()
-        payload += mc_bytes(verify_token).bytes()
-        self._send(payload)
+        self._send_fields("", public_key, verify_token)
 
 class EncryptionResponse(IncomingPacket):
 
     packet_id = 1
-    def recv(self):
-        shared_secret = bytes(mc_bytes.read(self))
+    blocking = True
+    def prepare(self):
+        self.shared_secret = bytes(mc_bytes.read(self))
         verify_token = bytes(mc_bytes.read(self))
 
         if verify_token != self.connection.crypto.verify_token:
             raise IllegalData("Verify tokens do not match!")
 
-        if len(shared_secret) != 16:
+        if len(self.shared_secret) != 16:
             raise IllegalData("Invalid shared secret!")
 
-        self.connection.crypto.init_aes(shared_secret)
+        # the client has switched to encryption by now, so a failed check is
+        # only raised once the cipher is set up
+        self.error = None
+        login_hash = self.connection.crypto.generate_login_hash(self.shared_secret)
+        try:
+            self.connection.player.verify(login_hash)
+        except IllegalData as e:
+            self.error = e
+        self.prepared = True
+
+    def recv(self):
+        if not self.prepared:
+            self.prepare()
 
-        login_hash = self.connection.crypto.generate_login_hash(shared_secret)
-        self.connection.player.verify(login_hash)
+        self.connection.crypto.init_aes(self.shared_secret)
+        if self.error is not None:
+            raise self.error
 
         self.connection.join_game()
 
 class LoginSuccess(OutgoingPacket):
 
     packet_id = 2
+    layout = (mc_string, mc_string)
     def send(self):
-        payload = mc_string(self.connection.player.uuid).bytes()
-        payload += mc_string(self.connection.player.username).bytes()
-        self._send(payload)
+        self._send_fields(str(self.connection.player.uuid), self.connection.player.username)
 
 class SetCompression(OutgoingPacket):
 
     packet_id = 3
+    layout = (mc_varint,)
     def __init__(self, conn, threshold=None):
         super().__init__(conn)
         if threshold is None:
@@ -267,40 +401,43 @@ class SetCompression(OutgoingPacket):
 
     def send(self):
         print("compression packet")
-        self._send(mc_varint(self.threshold))
+        self._send_fields(self.threshold)
         self.connection.compression = self.threshold
 
 class IncomingKeepAlive(IncomingPacket):
 
     packet_id = 0x0B
+    def __init__(self, conn, buffer):
+        super().__init__(conn, buffer)
+        # PLAY packets wait for the tick, the round trip ends on arrival
+        self.received = time.monotonic()
+
     def recv(self):
         token = int(mc_varint.read(self))
-        self.connection.keepalive.callback(token)
+        self.connection.keepalive.callback(token, self.received)
 
 class OutgoingKeepAlive(OutgoingPacket):
 
     packet_id = 0x1F
+    layout = (mc_varint,)
     def __init__(self, conn, token):
         super().__init__(conn)
         self.id = token
 
     def send(self):
-        self._send(mc_varint(self.id))
+        self._send_fields(self.id)
 
 class JoinGame(OutgoingPacket):
 
     packet_id = 0x23
+    layout = (mc_int, mc_ubyte, mc_sbyte, mc_ubyte, mc_ubyte, mc_string, mc_bool)
     def send(self):
         print("join packet")
-        payload = b''
-        payload += mc_int(self.player.entity.entity_id).bytes()
-        payload += mc_ubyte(self.player.entity.gamemode).bytes()
-        payload += mc_sbyte(self.player.entity.dimension).bytes()
-        payload += mc_ubyte(self.server.world.level.difficulty).bytes()
-        payload += mc_ubyte(self.config.get("players", {}).get("max", 10)).bytes()
-        payload += mc_string("default").bytes()
-        payload += mc_bool(False).bytes()
-        self._send(payload)
+        entity = self.player.entity
+        self._send_fields(entity.entity_id, entity.gamemode, entity.dimension,
+                          self.server.world.level.difficulty,
+                          self.config.get("players", {}).get("max", 10),
+                          "default", False)
 
 class ClientStatus(IncomingPacket):
 
@@ -346,31 +483,34 @@ class OutgoingPluginMessage(OutgoingPacket):
 class Disconnect(OutgoingPacket):
 
     packet_id = 0x1A
+    layout = (mc_string,)
     def __init__(self, conn, reason):
         super().__init__(conn)
         self.reason = mc_string(reason)
 
     def send(self):
-        self._send(self.reason.bytes())
+        self._send_fields(self.reason)
         self.connection.close()
 
 class ServerDifficulty(OutgoingPacket):
 
     packet_id = 0x0D
+    layout = (mc_ubyte,)
     def send(self):
-        self._send(mc_ubyte(self.server.world.level.difficulty).bytes())
+        self._send_fields(self.server.world.level.difficulty)
 
 class SpawnPosition(OutgoingPacket):
 
     packet_id = 0x43
+    layout = (mc_pos,)
     def send(self):
-        self._send(mc_pos(self.server.world.level.spawn_position).bytes())
+        self._send_fields(self.server.world.level.spawn_position)
 
 class OutgoingPlayerAbilities(OutgoingPacket):
 
     packet_id = 0x2B
+    layout = (mc_sbyte, mc_float, mc_float)
     def send(self):
-        payload = b''
         abilities = 0
         if self.player.entity.abilities.invulnerable:
             abilities |= 0x01
@@ -381,10 +521,9 @@ class OutgoingPlayerAbilities(OutgoingPacket):
         if self.player.entity.gamemode == Gamemode.CREATIVE:
             abilities |= 0x08
 
-        payload += mc_sbyte(abilities).bytes()
-        payload += mc_float(self.player.entity.abilities.fly_speed).bytes()
-        payload += mc_float(self.player.entity.abilities.walk_speed).bytes()
-        self._send(payload)
+        self._send_fields(abilities,
+                          self.player.entity.abilities.fly_speed,
+                          self.player.entity.abilities.walk_speed)
 
 class BasicPlayerUpdate(IncomingPacket):
 
@@ -447,6 +586,7 @@ class OutgoingPlayerPositionLook(OutgoingPacket):
     YAW_RELATIVE = 0x10
 
     packet_id = 0x2E
+    layout = (mc_double, mc_double, mc_double, mc_float, mc_float, mc_sbyte, mc_varint)
     def __init__(self, conn, pos=None, yaw=None, pitch=None, flags=0):
         super().__init__(conn)
         self.pos = pos
@@ -464,7 +604,6 @@ class OutgoingPlayerPositionLook(OutgoingPacket):
             raise ValueError("if yaw is relative, new yaw must be specified.")
 
     def send(self):
-        payload = b''
         last_pos = mc_vec3f(self.player.entity.position)
         last_pitch = self.player.entity.pitch
         last_yaw = self.player.entity.yaw
@@ -484,18 +623,10 @@ class OutgoingPlayerPositionLook(OutgoingPacket):
         if self.flags & self.YAW_RELATIVE:
             yaw -= last_yaw
 
-        payload += mc_double(pos.x).bytes()
-        payload += mc_double(pos.y).bytes()
-        payload += mc_double(pos.z).bytes()
-        payload += mc_float(yaw).bytes()
-        payload += mc_float(pitch).bytes()
-        payload += mc_sbyte(self.flags).bytes()
-
         teleport_id = random.randint(1, 2**24-1)
         self.player.teleport_ids.append(teleport_id)
-        payload += mc_varint(teleport_id).bytes()
 
-        self._send(payload)
+        self._send_fields(pos.x, pos.y, pos.z, yaw, pitch, self.flags, teleport_id)
 
 class TeleportConfirm(IncomingPacket):
 
@@ -508,41 +639,74 @@ class TeleportConfirm(IncomingPacket):
 class ChunkData(OutgoingPacket):
 
     packet_id = 0x20
-    def __init__(self, conn, x, z):
+    layout = (mc_int, mc_int, mc_bool, mc_varint, mc_varint)
+    def __init__(self, conn, x, z, dimension=0, chunk=None):
         super().__init__(conn)
         self.x = x
         self.z = z
-        self.chunk = self.server.world.get_chunk(x, z)
+        self.dimension = dimension
+        self.chunk = chunk
+
+    def body(self):
+        # the packet id and fixed header are packed by the layout, the section
+        # data is joined onto it in one go
+        if self.chunk is None:
+            self.chunk = self.server.world.get_chunk(self.x, self.z, dimension=self.dimension)
 
-    def send(self):
-        payload = b''
-        payload += mc_int(self.x).bytes()
-        payload += mc_int(self.z).bytes()
-        payload += mc_bool(True).bytes()
         bitmask = 0
         biomes = self.chunk.biomes.bytes()
         size = len(biomes)
         sections = [b'' for i in range(0, 256, 16)]
-        print(self.chunk.sections)
         for section in self.chunk.sections:
             bitmask |= (1 << section.y_index)
             s_bytes = section.bytes()
             size += len(s_bytes)
             sections[section.y_index] = s_bytes
 
-        payload += mc_varint(bitmask).bytes()
-        payload += mc_varint(size).bytes()
-        payload += b''.join(sections)
-        payload += biomes
+        header = self._packer.pack(self.x, self.z, True, bitmask, size)
 
-        entities = b''
-        for entity in self.chunk.tile_entities:
-            entities += nbt_to_bytes(entity.to_nbt())
+        # current protocol (1.11) sends the tile entities after this, target protocol for now (1.9) doesn't
+        return b''.join((header, *sections, biomes))
 
-        # current protocol (1.11) sends this, target protocol for now (1.9) doesn't
-        # payload += mc_varint(len(self.chunk.tile_entities)).bytes()
-        # payload += entities
-        self._send(payload)
+    def send(self):
+        # framed packets are shared between players until the chunk changes
+        cache = self.server.chunk_cache
+        key = (self.dimension, self.x, self.z)
+        stamp = (self.server.world.chunk_stamp(self.x, self.z, self.dimension), self.connection.compression)
+
+        frame = cache.get(key, stamp)
+        if frame is None:
+            parts = self._frame_body(self.body())
+            if isinstance(parts[0], Future):
+                frame = parts[0]
+                cache.put_future(key, stamp, frame)
+            else:
+                frame = b''.join(parts)
+                cache.put(key, stamp, frame)
+
+        self._send_frame(frame)
+        if self.connection.tracer.enabled:
+            # the cached frame is possibly compressed, so only its size is
+            # traced, once it is known for frames still being compressed
+            conn, tracer = self.connection, self.connection.tracer
+            if isinstance(frame, Future):
+                frame.add_done_callback(lambda f: f.exception() or
+                                        tracer.record(conn, OUTBOUND, self.packet_id, None, len(f.result())))
+            else:
+                tracer.record(conn, OUTBOUND, self.packet_id, None, len(frame))
+
+
+class UnloadChunk(OutgoingPacket):
+
+    packet_id = 0x1D
+    layout = (mc_int, mc_int)
+    def __init__(self, conn, x, z):
+        super().__init__(conn)
+        self.x = x
+        self.z = z
+
+    def send(self):
+        self._send_fields(self.x, self.z)
 
 
 IncomingPacket.PLAY_PACKET_MAP = {
@@ -3,6 +3,7 @@
 import os
 import json
 import uuid
+from math import floor, radians, sin, cos
 from urllib.error import HTTPError
 from urllib.parse import quote
 from urllib.request import urlopen
@@ -15,22 +16,51 @@ from .types import Gamemode, Dimension, Difficulty
 from .entity import PlayerEntity
 from .packet import \
     ServerDifficulty, SpawnPosition, OutgoingPlayerAbilities, \
-    OutgoingPlayerPositionLook, ChunkData
+    OutgoingPlayerPositionLook
+from .stream import ChunkStreamer
 
 __author__ = 'Thomas Bell'
 
 HAS_JOINED_URL = "https://sessionserver.mojang.com/session/minecraft/hasJoined?username={}&serverId={}"
 
+# both of these block on a web request
+
+def lookup_uuid(username):
+    user_name = quote(str(username))
+    try:
+        res = cache.fetch("https://api.mojang.com/users/profiles/minecraft/{}".format(user_name))
+        return uuid.UUID(json.loads(res)["id"])
+    except Exception:
+        return uuid.uuid5(UUID_NAMESPACE, str(username))
+
+def has_joined(username, login_hash):
+    user_name = quote(str(username))
+    try:
+        res = urlopen(HAS_JOINED_URL.format(user_name, login_hash))
+        return uuid.UUID(json.loads(res)["id"])
+
+    except HTTPError as e:
+        if e.code == 204:  # No Content
+            raise IllegalData("User is not logged in!")
+
+        else:
+            raise
+
 class Player:
 
-    def __init__(self, conn, username, resolve_uuid=False):
+    def __init__(self, conn, username, resolve_uuid=False, player_uuid=None):
         self.connection = conn
         self.server = conn.server
         self.username = username
         self.config = conn.config
-        self.uuid = None
+        self.uuid = player_uuid
 
-        self._resolve_uuid()
+        if self.uuid is not None:
+            pass
+        elif resolve_uuid:
+            self.uuid = lookup_uuid(self.username)
+        else:
+            self.uuid = uuid.uuid5(UUID_NAMESPACE, str(self.username))
 
         self.entity = self.server.world.get_player(self.uuid)
         self.entity.uuid = self.uuid
@@ -45,6 +75,28 @@ class Player:
 
         self.teleport_ids = []
         self.is_ready = False
+        self.chunk_position = None
+        self.streamer = ChunkStreamer(self)
+
+    @property
+    def chunk(self):
+        return (floor(self.entity.position.x) >> 4,
+                floor(self.entity.position.z) >> 4)
+
+    def moved(self):
+        chunk = self.chunk
+        if chunk == self.chunk_position:
+            return
+
+        # keep the surrounding chunks loaded while the player is nearby
+        self.chunk_position = chunk
+        radius = self.config.get("world_cache", {}).get("pin_radius", 2)
+        dimension = self.entity.dimension
+        self.server.world.pin_chunks(self, {
+            (dimension, x, z)
+            for x in range(chunk[0] - radius, chunk[0] + radius + 1)
+            for z in range(chunk[1] - radius, chunk[1] + radius + 1)})
+        self.prefetch()
 
     def spawn(self):
         ServerDifficulty(self.connection).send()
@@ -54,30 +106,25 @@ class Player:
                                    self.entity.spawn_position,
                                    self.entity.yaw,
                                    self.entity.pitch).send()
-        ChunkData(self.connection,
-                  int(self.entity.position.x) >> 4,
-                  int(self.entity.position.z) >> 4).send()
-
-    def _resolve_uuid(self):
-        user_name = quote(str(self.username))
-        try:
-            res = cache.fetch("https://api.mojang.com/users/profiles/minecraft/{}".format(user_name))
-            self.uuid = uuid.UUID(json.loads(res)["id"])
-        except Exception:
-            self.uuid = uuid.uuid5(UUID_NAMESPACE, str(self.username))
+        self.moved()
+        self.streamer.tick()
+
+    def prefetch(self):
+        # warm the chunks the player is heading towards
+        distance = self.config.get("world_cache", {}).get("prefetch_distance", 3)
+        yaw = radians(self.entity.yaw)
+        dx, dz = -sin(yaw), cos(yaw)
+        x, z = self.chunk
+        requested = set()
+        for i in range(1, distance + 1):
+            cx, cz = x + round(i * dx), z + round(i * dz)
+            for key in ((cx, cz), (cx + round(dz), cz - round(dx)), (cx - round(dz), cz + round(dx))):
+                if key not in requested:
+                    requested.add(key)
+                    self.server.world.request_chunk(*key, self.entity.dimension)
 
     def verify(self, login_hash):
-        user_name = quote(str(self.username))
-        try:
-            res = urlopen(HAS_JOINED_URL.format(user_name, login_hash))
-            self.uuid = uuid.UUID(json.loads(res)["id"])
-
-        except HTTPError as e:
-            if e.code == 204:  # No Content
-                raise IllegalData("User is not logged in!")
-
-            else:
-                raise
+        self.uuid = has_joined(self.username, login_hash)
 
     def __bool__(self):
         return bool(self.connection)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import gzip
+import mmap
+import zlib
+import struct
+import threading
+from io import BytesIO
+from array import array
+from pathlib import Path
+
+from nbt import nbt
+
+__author__ = 'Thomas Bell'
+
+SECTOR_LENGTH = 4096
+HEADER_LENGTH = 2 * SECTOR_LENGTH
+
+COMPRESSION_GZIP = 1
+COMPRESSION_ZLIB = 2
+COMPRESSION_NONE = 3
+COMPRESSION_EXTERNAL = 0x80
+
+class RegionError(Exception):
+    pass
+
+class ChunkNotFound(RegionError, KeyError):
+    pass
+
+class RegionClosed(RegionError):
+    pass
+
+class RegionFile:
+
+    NAME_PATTERN = re.compile(r"r\.(-?\d+)\.(-?\d+)\.mc[ar]$")
+    def __init__(self, path):
+        self.path = Path(path)
+        match = self.NAME_PATTERN.search(self.path.name)
+        self.x, self.z = (int(match.group(1)), int(match.group(2))) if match else (0, 0)
+
+        self.lock = threading.Lock()
+        self.readers = 0
+        self.closing = False
+        self.closed = False
+
+        self.file = open(str(self.path), "rb")
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.map = None
+        header = array("I", bytes(HEADER_LENGTH))
+        if self.size >= HEADER_LENGTH:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            header = array("I", self.map[:HEADER_LENGTH])
+            if sys.byteorder == "little":
+                header.byteswap()
+
+        self.locations = header[:1024]
+        self.timestamps = header[1024:]
+
+    def has_chunk(self, x, z):
+        return self.locations[(x & 0x1f) + (z & 0x1f) * 32] != 0
+
+    def get_timestamp(self, x, z):
+        return self.timestamps[(x & 0x1f) + (z & 0x1f) * 32]
+
+    def _external_path(self, x, z):
+        return self.path.with_name("c.{}.{}.mcc".format(self.x*32 + (x & 0x1f), self.z*32 + (z & 0x1f)))
+
+    def get_blockdata(self, x, z):
+        with self.lock:
+            if self.closed or self.closing:
+                raise RegionClosed("Region file {} is closed".format(self.path.name))
+            self.readers += 1
+
+        try:
+            return self._read(x, z)
+        finally:
+            with self.lock:
+                self.readers -= 1
+                if self.closing and not self.readers:
+                    self._close()
+
+    def _read(self, x, z):
+        location = self.locations[(x & 0x1f) + (z & 0x1f) * 32]
+        offset, sectors = location >> 8, location & 0xFF
+        if location == 0:
+            raise ChunkNotFound("Chunk {}, {} is not present in region".format(x, z))
+
+        start = offset * SECTOR_LENGTH
+        if offset < 2 or start + 5 > self.size:
+            raise RegionError("Chunk {}, {} lies outside of the region data".format(x, z))
+
+        length, compression = struct.unpack_from(">IB", self.map, start)
+        if compression & COMPRESSION_EXTERNAL:
+            with open(str(self._external_path(x, z)), "rb") as fp:
+                return self._decompress(compression & ~COMPRESSION_EXTERNAL, fp.read())
+
+        end = start + 4 + length
+        if length < 1 or end > self.size:
+            raise RegionError("Chunk {}, {} has an invalid length".format(x, z))
+
+        # decompress straight out of the mapping, the view must be released before close()
+        data = memoryview(self.map)[start+5:end]
+        try:
+            return self._decompress(compression, data)
+        finally:
+            data.release()
+
+    @staticmethod
+    def _decompress(compression, data):
+        try:
+            if compression == COMPRESSION_ZLIB:
+                return zlib.decompress(data)
+            elif compression == COMPRESSION_GZIP:
+                return gzip.decompress(data)
+            elif compression == COMPRESSION_NONE:
+                return bytes(data)
+        except (zlib.error, OSError, EOFError) as e:
+            raise RegionError("Chunk data is corrupt: {}".format(e))
+
+        raise RegionError("Unknown chunk compression: {}".format(compression))
+
+    def get_nbt(self, x, z):
+        return nbt.NBTFile(buffer=BytesIO(self.get_blockdata(x, z)))
+
+    def _close(self):
+        self.closed = True
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+    def close(self):
+        # readers in other threads finish before the mapping goes away
+        with self.lock:
+            if self.closed or self.closing:
+                return
+
+            self.closing = True
+            if not self.readers:
+                self._close()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+import asyncio
+import argparse
+import itertools
+
+from . import varint
+from .capture import load_sessions, frame_body
+from .client import AsyncClient
+from .net import ProtocolError
+from .packet import IncomingKeepAlive
+from .types import States
+
+__author__ = 'Thomas Bell'
+
+# Replays the client side of captured sessions against a running server.
+# Each simulated client logs in under its own name and then sends the PLAY
+# packets of one recorded session with the original spacing divided by the
+# speed factor. Keepalives are answered live instead of replayed.
+
+def play_packets(records):
+    # [(offset from the first PLAY packet, packet body)]
+    packets = []
+    start = None
+    for record in records:
+        if record.state != States.PLAY:
+            continue
+
+        body = frame_body(record.frame, record.compression)
+        packet_id, _ = varint.decode(body)
+        if packet_id == IncomingKeepAlive.packet_id:
+            continue
+
+        if start is None:
+            start = record.time
+        packets.append((record.time - start, body))
+
+    return packets
+
+async def _drain(client):
+    while True:
+        await client.read_packet()
+
+async def replay_client(host, port, name, packets, speed, linger, stats):
+    client = AsyncClient(host, port, name)
+    reader = None
+    try:
+        started = time.perf_counter()
+        await client.connect()
+        await client.login()
+        stats["login"].append(time.perf_counter() - started)
+
+        reader = asyncio.ensure_future(_drain(client))
+        start = time.perf_counter()
+        for offset, body in packets:
+            delay = start + offset / speed - time.perf_counter()
+            if delay > 0:
+                await client.writer.drain()
+                await asyncio.sleep(delay)
+
+            client.send_body(body)
+
+        await client.writer.drain()
+        await asyncio.sleep(linger)
+        if reader.done():
+            reader.result()
+
+    except (ProtocolError, ConnectionError, OSError) as e:
+        print("{}: {}".format(name, e), file=sys.stderr)
+        stats["errors"] += 1
+
+    finally:
+        if reader is not None:
+            reader.cancel()
+        client.close()
+        stats["sent"] += client.sent_packets
+        stats["received"] += client.recv_packets
+        stats["recv_bytes"] += client.recv_bytes
+
+async def replay(sessions, host, port, clients, speed=1.0, linger=1.0, ramp=0.0, prefix="replay"):
+    stats = {"login": [], "errors": 0, "sent": 0, "received": 0, "recv_bytes": 0}
+    sessions = itertools.cycle(sessions)
+
+    tasks = []
+    for i in range(clients):
+        tasks.append(asyncio.ensure_future(replay_client(host, port, "{}{}".format(prefix, i),
+                                                         next(sessions), speed, linger, stats)))
+        if ramp:
+            await asyncio.sleep(ramp)
+
+    await asyncio.gather(*tasks)
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured client sessions against a server.")
+    parser.add_argument("capture", help="Session capture written with the \"capture\" config option.")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=25565)
+    parser.add_argument("-n", "--clients", type=int, default=1,
+                        help="Simulated clients, sessions are reused round-robin.")
+    parser.add_argument("-s", "--speed", type=float, default=1.0,
+                        help="Playback speed, 2 sends twice as fast as recorded.")
+    parser.add_argument("--ramp", type=float, default=0.0,
+                        help="Seconds between client connects.")
+    parser.add_argument("--linger", type=float, default=1.0,
+                        help="Seconds to keep reading after the last packet.")
+    args = parser.parse_args()
+
+    sessions = [play_packets(records) for records in load_sessions(args.capture).values()]
+    sessions = [packets for packets in sessions if packets]
+    if not sessions:
+        print("no PLAY traffic in {}".format(args.capture), file=sys.stderr)
+        sys.exit(1)
+
+    started = time.perf_counter()
+    stats = asyncio.run(replay(sessions, args.host, args.port, args.clients,
+                               args.speed, args.linger, args.ramp))
+    elapsed = time.perf_counter() - started
+
+    logins = sorted(stats["login"])
+    print("{} clients, {} sessions, {:.2f}s".format(args.clients, len(sessions), elapsed))
+    print("sent {} packets, received {} packets ({} bytes), {} errors".format(
+        stats["sent"], stats["received"], stats["recv_bytes"], stats["errors"]))
+    if logins:
+        print("login: median {:.1f} ms, max {:.1f} ms".format(
+            1000*logins[len(logins)//2], 1000*logins[-1]))
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,14 @@
 import socket
 import threading
 
+from .aio import AsyncEngine
+from .capture import SessionCapture
+from .chunkcache import ChunkPacketCache
+from .compress import Compressor, ZlibCodec
 from .connection import MCConnection
 from .crypto import generate_keys
+from .tick import TickScheduler
+from .trace import PacketTracer
 from .world import MCWorld
 
 class MCServer:
@@ -19,12 +25,42 @@ class MCServer:
         self.connections = []
 
         self.players = []
+        self.status = None  # SharedStatus when running as a supervised worker
         self.entities = []
         self.private_key, self.public_key = generate_keys()
-        self.world = MCWorld(config.get("world", None))
+        world_cache = config.get("world_cache", {})
+        self.world = MCWorld(config.get("world", None),
+                             max_chunks=world_cache.get("chunks", None),
+                             max_regions=world_cache.get("regions", None),
+                             loader_threads=world_cache.get("loader_threads", None),
+                             lazy_nbt=world_cache.get("lazy_nbt", True))
+        self.chunk_cache = self._chunk_cache(config)
+        self.world.chunk_listeners.append(self.chunk_cache.invalidate)
+        self.tracer = PacketTracer.from_config(config.get("trace", {}))
+        self.capture = SessionCapture(config["capture"]) if config.get("capture") else None
+        self.compressor = Compressor.from_config(config.get("compressor", {}))
+        ticks = config.get("ticks", {})
+        self.ticker = TickScheduler(self, ticks.get("rate", None), ticks.get("report_interval", None))
+        if self.compressor.report_interval:
+            self.ticker.call_soon(self._report_compression)
+        self.aio = None
 
         self.thread = threading.Thread(target=self._worker)
 
+    def _chunk_cache(self, config):
+        # frames sent without network compression can be kept compressed,
+        # optionally with a preset dictionary made by claspymc.zdict
+        cache_config = config.get("chunk_cache", {})
+        codec = None
+        if cache_config.get("compress", False) and config.get("compression", -1) < 0:
+            zdict = None
+            if cache_config.get("zdict", None):
+                with open(cache_config["zdict"], "rb") as f:
+                    zdict = f.read()
+            codec = ZlibCodec(cache_config.get("level", None), zdict)
+
+        return ChunkPacketCache(cache_config.get("max_bytes", None), codec)
+
     def start(self):
         self.thread.start()
 
@@ -35,11 +71,20 @@ class MCServer:
         host = self.config.get("host", "")
         port = self.config.get("port", 25565)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.config.get("reuse_port", False):
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.sock.bind((host, port))
         self.sock.listen(self.config.get("max_connections", 32))
 
         print("est. <{}:{}>".format(host, port))
 
+        if self.config.get("engine", "threaded") == "asyncio":
+            self.aio = AsyncEngine(self)
+            self.aio.run()
+            return
+
+        self.ticker.start()
+
         while True:
             conn, addr = self.sock.accept()
 
@@ -58,7 +103,7 @@ class MCServer:
             },
             "players": {
                 "max": self.config.get("players", {}).get("max", 10),
-                "online": len([p for p in self.players if p])
+                "online": self.status.online_total() if self.status is not None else self.online()
             },
             "description": {
                 "text": self.config.get("description", "A Minecraft Server running with ClaspyMC")
@@ -66,11 +111,42 @@ class MCServer:
         }
         return d
 
+    def online(self):
+        return len([p for p in self.players if p])
+
+    def update_status(self):
+        if self.status is not None:
+            self.status.set_online(self.online())
+
+    def _report_compression(self):
+        # runs on the tick, every compressor report_interval seconds
+        self.compressor.report()
+        self.ticker.schedule(self.ticker.seconds(self.compressor.report_interval), self._report_compression)
+
+    def latency(self):
+        # keepalive round trip stats per player
+        return {conn.player.username: conn.keepalive.stats()
+                for conn in self.connections if conn and conn.player is not None}
+
     def close(self):
+        self.ticker.stop()
+        if not self.closed and self.aio is not None:
+            self.aio.stop()
+            self.tracer.close()
+            self.compressor.close()
+            if self.capture is not None:
+                self.capture.close()
+            self.closed = True
+
         if not self.closed:
             for conn in self.connections:
                 if conn: conn.close()
             self.sock.close()
+            self.world.close()
+            self.tracer.close()
+            self.compressor.close()
+            if self.capture is not None:
+                self.capture.close()
             self.closed = True
 
     def __bool__(self):
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import sys
+
+from .packet import ChunkData, UnloadChunk
+
+__author__ = 'Thomas Bell'
+
+class ChunkStreamer:
+
+    VIEW_DISTANCE = 8
+    CHUNKS_PER_TICK = 4
+    def __init__(self, player):
+        self.player = player
+        self.connection = player.connection
+        self.server = player.server
+        self.config = player.config.get("streaming", {})
+        # held by the server tick around everything it does for this connection
+        self.lock = self.connection.send_queue.lock
+
+        self.sent = set()
+        self.pending = {}
+        self.queue = []
+        self.center = None
+
+    @property
+    def view_distance(self):
+        limit = self.config.get("view_distance", self.VIEW_DISTANCE)
+        if self.player.view_distance > 0:
+            return min(self.player.view_distance, limit)
+        return limit
+
+    def _distance(self, key):
+        cx, cz = self.player.chunk
+        return (key[0] - cx)**2 + (key[1] - cz)**2
+
+    def update(self):
+        cx, cz = self.player.chunk
+        radius = self.view_distance
+        self.center = (cx, cz, radius)
+
+        in_range = {(x, z)
+                    for x in range(cx - radius, cx + radius + 1)
+                    for z in range(cz - radius, cz + radius + 1)}
+
+        for key in self.sent - in_range:
+            UnloadChunk(self.connection, *key).send()
+        self.sent &= in_range
+
+        for key in set(self.pending) - in_range:
+            del self.pending[key]
+
+        # furthest first, so the next chunk to send is popped off the end
+        self.queue = sorted(in_range - self.sent - set(self.pending),
+                            key=self._distance, reverse=True)
+
+    def tick(self):
+        # called once per server tick, chunks that finished loading in between
+        # are picked up on the next one
+        with self.lock:
+            cx, cz = self.player.chunk
+            if self.center != (cx, cz, self.view_distance):
+                self.update()
+
+            per_tick = self.config.get("chunks_per_tick", self.CHUNKS_PER_TICK)
+            world = self.server.world
+            dimension = self.player.entity.dimension
+            while self.queue and len(self.pending) < 2*per_tick:
+                key = self.queue.pop()
+                future = world.request_chunk(*key, dimension)
+                self.pending[key] = future
+
+            ready = sorted((key for key, future in self.pending.items() if future.done()),
+                           key=self._distance)
+            for key in ready[:per_tick]:
+                future = self.pending.pop(key)
+                if future.exception() is not None:
+                    # not sent, so it is queued again on the next update
+                    print("could not load chunk {}, {}: {}".format(*key, future.exception()), file=sys.stderr)
+                    continue
+
+                ChunkData(self.connection, *key, dimension, chunk=future.result()).send()
+                self.sent.add(key)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import signal
+import multiprocessing
+
+from .server import MCServer
+
+__author__ = 'Thomas Bell'
+
+# Multi-process mode: every worker process runs its own MCServer on the same
+# port (SO_REUSEPORT lets the kernel spread connections over them), the
+# supervisor restarts workers that die. Online counts are shared through an
+# array in shared memory, one slot per worker, so any worker can answer a
+# server list ping for all of them.
+
+class SharedStatus:
+
+    def __init__(self, online, index):
+        self.online = online
+        self.index = index
+
+    def set_online(self, count):
+        self.online[self.index] = count
+
+    def online_total(self):
+        with self.online.get_lock():
+            return sum(self.online)
+
+def worker_config(config, suffix):
+    # the capture files are opened with "wb", so every worker process,
+    # restarted ones included, writes its own
+    config = dict(config)
+    if config.get("capture"):
+        config["capture"] = "{}.{}".format(config["capture"], suffix)
+
+    trace = config.get("trace") or {}
+    if trace.get("capture"):
+        config["trace"] = dict(trace, capture="{}.{}".format(trace["capture"], suffix))
+
+    return config
+
+def _terminate(signum, frame):
+    sys.exit(0)
+
+def run_worker(config, online, index):
+    # the supervisor handles SIGINT for everyone and stops workers with SIGTERM,
+    # which closes the server so captures are complete
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _terminate)
+    server = MCServer(worker_config(config, os.getpid()))
+    server.status = SharedStatus(online, index)
+    try:
+        server.start()
+        server.join()
+    finally:
+        server.close()
+
+class Supervisor:
+
+    POLL_INTERVAL = 0.5
+    MIN_UPTIME = 10
+    MAX_BACKOFF = 30
+    def __init__(self, configs, workers):
+        self.context = multiprocessing.get_context("fork")
+        self.running = False
+        self.workers = []
+        for config in configs:
+            online = self.context.Array("i", workers)
+            for index in range(workers):
+                self.workers.append({
+                    "config": dict(config, reuse_port=True),
+                    "online": online,
+                    "index": index,
+                    "process": None,
+                    "started": 0,
+                    "backoff": 1,
+                    "restart_at": 0
+                })
+
+    def _spawn(self, worker):
+        process = self.context.Process(target=run_worker, daemon=True,
+                                       args=(worker["config"], worker["online"], worker["index"]))
+        process.start()
+        worker["process"] = process
+        worker["started"] = time.monotonic()
+        print("worker {} on port {} started (pid {})".format(
+            worker["index"], worker["config"].get("port", 25565), process.pid))
+
+    def _check(self, worker):
+        process = worker["process"]
+        now = time.monotonic()
+        if process is not None:
+            if process.is_alive():
+                return
+
+            # restart at once after a long run, back off while it keeps crashing
+            worker["online"][worker["index"]] = 0
+            if now - worker["started"] >= self.MIN_UPTIME:
+                worker["backoff"] = 1
+            else:
+                worker["backoff"] = min(2*worker["backoff"], self.MAX_BACKOFF)
+
+            print("worker {} exited with code {}, restarting in {}s".format(
+                worker["index"], process.exitcode, worker["backoff"]), file=sys.stderr)
+            worker["process"] = None
+            worker["restart_at"] = now + worker["backoff"]
+
+        if now >= worker["restart_at"]:
+            self._spawn(worker)
+
+    def _stop(self, signum, frame):
+        self.running = False
+
+    def run(self):
+        self.running = True
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        for worker in self.workers:
+            self._spawn(worker)
+
+        try:
+            while self.running:
+                time.sleep(self.POLL_INTERVAL)
+                for worker in self.workers:
+                    self._check(worker)
+        finally:
+            self.stop()
+
+    def stop(self):
+        processes = [w["process"] for w in self.workers if w["process"] is not None]
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(5)
+            if process.is_alive():
+                process.kill()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+import asyncio
+import threading
+import traceback
+from collections import deque
+
+from .net import ProtocolError, IllegalData
+from .packet import Disconnect
+
+__author__ = 'Thomas Bell'
+
+PHASES = ("inbound", "movement", "tasks", "flush")
+
+class Timer:
+
+    __slots__ = ("rounds", "callback", "args", "cancelled")
+    def __init__(self, rounds, callback, args):
+        self.rounds = rounds
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class TimerWheel:
+
+    # hashed timer wheel with one slot per tick, timers further out than a
+    # turn of the wheel sit out the extra rounds in their slot. Adding and
+    # cancelling are O(1), each advance only looks at one slot.
+
+    SLOTS = 512
+    def __init__(self, slots=None):
+        self.slots = [[] for _ in range(slots or self.SLOTS)]
+        self.position = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, ticks, callback, *args):
+        # fires on the ticks-th advance from now, at least the next one
+        ticks = max(1, int(ticks))
+        timer = Timer((ticks - 1) // len(self.slots), callback, args)
+        self.slots[(self.position + ticks - 1) % len(self.slots)].append(timer)
+        self.count += 1
+        return timer
+
+    def advance(self):
+        # returns the timers that are due
+        slot = self.slots[self.position % len(self.slots)]
+        self.position += 1
+        if not slot:
+            return []
+
+        due = []
+        waiting = []
+        for timer in slot:
+            if timer.cancelled:
+                self.count -= 1
+            elif timer.rounds:
+                timer.rounds -= 1
+                waiting.append(timer)
+            else:
+                self.count -= 1
+                due.append(timer)
+
+        slot[:] = waiting
+        return due
+
+class TickScheduler:
+
+    # The game loop. Every tick drains the PLAY packets queued by the
+    # connections, moves players and streams their chunks, runs due tasks and
+    # flushes all send queues, in that order. Runs on its own thread for the
+    # threaded engine and as a task on the event loop for the asyncio one.
+
+    RATE = 20
+    REPORT_INTERVAL = 10
+    MAX_BEHIND = 1.0
+    def __init__(self, server, rate=None, report_interval=None):
+        self.server = server
+        self.rate = rate or self.RATE
+        self.interval = 1 / self.rate
+        self.report_interval = report_interval or self.REPORT_INTERVAL
+        self.running = False
+        self.thread = None
+
+        self.tick_count = 0
+        self.timers = TimerWheel()
+        self.soon = deque()  # filled from any thread
+
+        self.overloaded = 0
+        self.skipped = 0
+        self.last_report = 0
+        self.phase_total = dict.fromkeys(PHASES, 0.0)
+        self.phase_max = dict.fromkeys(PHASES, 0.0)
+        self.tick_max = 0.0
+
+    def call_soon(self, callback, *args):
+        # thread safe, runs in the tasks phase of the next tick
+        self.soon.append((callback, args))
+
+    def schedule(self, ticks, callback, *args):
+        # only from the tick itself, returns a Timer that can be cancelled
+        return self.timers.add(ticks, callback, *args)
+
+    def seconds(self, seconds):
+        return max(1, round(seconds * self.rate))
+
+    def _connections(self):
+        return [conn for conn in self.server.connections if conn]
+
+    def _run(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception:
+            traceback.print_exc()
+
+    def _inbound(self, connections):
+        for conn in connections:
+            with conn.send_queue.lock:
+                try:
+                    while conn.inbound and not conn.closed:
+                        conn.inbound.popleft().recv()
+
+                except IllegalData as e:
+                    print(e, file=sys.stderr)
+                    Disconnect(conn, str(e)).send()
+
+                except ProtocolError as e:
+                    print(e, file=sys.stderr)
+                    conn.close()
+
+                except Exception:
+                    traceback.print_exc()
+                    conn.close()
+
+    def _movement(self, connections):
+        for conn in connections:
+            if conn.spawned and not conn.closed:
+                with conn.send_queue.lock:
+                    conn.player.moved()
+                    conn.player.streamer.tick()
+
+    def _tasks(self):
+        while self.soon:
+            callback, args = self.soon.popleft()
+            self._run(callback, *args)
+
+        for timer in self.timers.advance():
+            if not timer.cancelled:
+                self._run(timer.callback, *timer.args)
+
+    def _flush(self, connections):
+        for conn in connections:
+            if len(conn.send_queue) and not conn.closed:
+                try:
+                    conn.flush()
+                except ProtocolError as e:
+                    print(e, file=sys.stderr)
+                    conn.close()
+
+    def tick(self):
+        connections = self._connections()
+        start = time.perf_counter()
+        self._inbound(connections)
+        inbound = time.perf_counter()
+        self._movement(connections)
+        movement = time.perf_counter()
+        self._tasks()
+        tasks = time.perf_counter()
+        self._flush(connections)
+        end = time.perf_counter()
+
+        self.tick_count += 1
+        self._record({"inbound": inbound - start, "movement": movement - inbound,
+                      "tasks": tasks - movement, "flush": end - tasks}, end - start)
+
+    def _record(self, phases, total):
+        for phase, seconds in phases.items():
+            self.phase_total[phase] += seconds
+            self.phase_max[phase] = max(self.phase_max[phase], seconds)
+        self.tick_max = max(self.tick_max, total)
+
+        if total > self.interval:
+            self.overloaded += 1
+            now = time.monotonic()
+            if now - self.last_report >= self.report_interval:
+                self.last_report = now
+                print("Can't keep up! Tick {} took {:.1f} ms ({}), {} overloaded ticks so far".format(
+                    self.tick_count, 1000*total,
+                    ", ".join("{} {:.1f} ms".format(p, 1000*s) for p, s in phases.items()),
+                    self.overloaded), file=sys.stderr)
+
+    def _next(self, deadline):
+        # the next deadline, dropping ticks rather than running them back to back
+        deadline += self.interval
+        behind = time.monotonic() - deadline
+        if behind > self.MAX_BEHIND:
+            missed = int(behind / self.interval)
+            self.skipped += missed
+            print("Running {:.0f} ms behind, skipping {} ticks".format(1000*behind, missed), file=sys.stderr)
+            deadline += missed * self.interval
+        return deadline
+
+    def _worker(self):
+        deadline = time.monotonic()
+        while self.running:
+            self.tick()
+            deadline = self._next(deadline)
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    async def run_async(self):
+        self.running = True
+        deadline = time.monotonic()
+        while self.running:
+            self.tick()
+            deadline = self._next(deadline)
+            await asyncio.sleep(max(0, deadline - time.monotonic()))
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def stats(self):
+        ticks = max(1, self.tick_count)
+        return {
+            "ticks": self.tick_count,
+            "overloaded": self.overloaded,
+            "skipped": self.skipped,
+            "timers": len(self.timers),
+            "max_ms": 1000*self.tick_max,
+            "mean_ms": {p: 1000*self.phase_total[p] / ticks for p in PHASES},
+            "phase_max_ms": {p: 1000*self.phase_max[p] for p in PHASES}
+        }
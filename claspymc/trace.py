@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+import time
+import struct
+import random
+import argparse
+import threading
+import itertools
+from collections import deque, namedtuple
+from enum import IntEnum
+
+from .types import States
+from .util import print_hex_dump
+
+__author__ = 'Thomas Bell'
+
+class TraceLevel(IntEnum):
+    OFF = 0
+    HEADERS = 1
+    PAYLOADS = 2
+
+INBOUND = 0
+OUTBOUND = 1
+DIRECTIONS = ("RECV", "SENT")
+
+TraceRecord = namedtuple("TraceRecord", "time connection direction state packet_id length payload")
+
+# capture file: magic, then one RECORD header per packet followed by its payload
+MAGIC = b"CLSPTRC1"
+RECORD = struct.Struct("!dIBBiI?")
+
+def parse_exclude(entry):
+    # ["play", "in", 0x0B] -> (States.PLAY, INBOUND, 0x0B), packet ids mean
+    # different packets depending on the state and direction
+    state, direction, packet_id = entry
+    if isinstance(state, str):
+        state = States[state.upper()]
+    if isinstance(direction, str):
+        direction = {"in": INBOUND, "out": OUTBOUND}[direction.lower()]
+    return (States(state), direction, packet_id)
+
+class PacketTracer:
+
+    RING_SIZE = 1024
+    def __init__(self, level=TraceLevel.OFF, packets=None, exclude=None, sample=1.0,
+                 ring_size=None, capture=None, stdout=False):
+        self.level = TraceLevel(level)
+        self.packets = frozenset(packets or ())
+        self.exclude = frozenset(parse_exclude(entry) for entry in exclude or ())
+        self.sample = sample
+        self.ring = deque(maxlen=ring_size or self.RING_SIZE)
+        self.stdout = stdout
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+
+        self.capture = None
+        if capture:
+            self.capture = open(capture, "wb")
+            self.capture.write(MAGIC)
+
+        # the only thing the hot path looks at
+        self.enabled = self.level > TraceLevel.OFF
+
+    @classmethod
+    def from_config(cls, config):
+        level = config.get("level", "off")
+        if isinstance(level, str):
+            level = TraceLevel[level.upper()]
+
+        return cls(level=level,
+                   packets=config.get("packets"),
+                   exclude=config.get("exclude"),
+                   sample=config.get("sample", 1.0),
+                   ring_size=config.get("ring_size"),
+                   capture=config.get("capture"),
+                   stdout=config.get("stdout", False))
+
+    def next_id(self):
+        return next(self.ids)
+
+    def record(self, conn, direction, packet_id, payload, length=None):
+        if self.packets and packet_id not in self.packets:
+            return
+        if self.exclude and (conn.state, direction, packet_id) in self.exclude:
+            return
+        if self.sample < 1.0 and random.random() >= self.sample:
+            return
+
+        if length is None:
+            length = len(payload) if payload is not None else 0
+        if self.level < TraceLevel.PAYLOADS or payload is None:
+            payload = None
+        else:
+            payload = bytes(payload)
+
+        record = TraceRecord(time.time(), conn.trace_id, direction, int(conn.state), packet_id, length, payload)
+        self.ring.append(record)
+
+        if self.capture is not None:
+            with self.lock:
+                if self.capture is not None:
+                    self.capture.write(RECORD.pack(record.time, record.connection, direction,
+                                                   record.state, packet_id, length, payload is not None))
+                    if payload is not None:
+                        self.capture.write(payload)
+
+        if self.stdout:
+            print_record(record)
+
+    def records(self):
+        return list(self.ring)
+
+    def close(self):
+        with self.lock:
+            if self.capture is not None:
+                self.capture.close()
+                self.capture = None
+
+def print_record(record):
+    print("{} PACKET (conn={}, length={}, id={:#04x}, state={})".format(
+        DIRECTIONS[record.direction], record.connection, record.length, record.packet_id, record.state))
+    if record.payload is not None:
+        print_hex_dump(record.payload)
+
+def read_capture(fp):
+    if fp.read(len(MAGIC)) != MAGIC:
+        raise ValueError("not a packet trace capture")
+
+    while True:
+        header = fp.read(RECORD.size)
+        if len(header) < RECORD.size:
+            return
+
+        t, connection, direction, state, packet_id, length, has_payload = RECORD.unpack(header)
+        payload = fp.read(length) if has_payload else None
+        yield TraceRecord(t, connection, direction, state, packet_id, length, payload)
+
+def main():
+    parser = argparse.ArgumentParser(description="Print a packet trace capture.")
+    parser.add_argument("capture", type=argparse.FileType("rb"))
+    parser.add_argument("-p", "--packet", type=lambda s: int(s, 0), action="append",
+                        help="Only show this packet id (repeatable).")
+    args = parser.parse_args()
+
+    for record in read_capture(args.capture):
+        if not args.packet or record.packet_id in args.packet:
+            print_record(record)
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,11 @@ import uuid
 import struct
 from io import BytesIO
 from enum import IntEnum
+from functools import partial
 
 from nbt import nbt
 
+from . import varint
 from .net import safe_recv, safe_send, ProtocolError
 
 __author__ = 'Thomas Bell'
@@ -78,14 +80,19 @@ class mc_nettype:
 
     format = None
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # compiled once per type instead of on every pack/unpack
+        cls._struct = struct.Struct(cls.format) if cls.format else None
+
     @classmethod
     def recv(cls, sock):
         if not cls.format:
             raise NotImplementedError("format undefined for mc_type subclass {}".format(cls.__name__))
 
-        buf = safe_recv(sock, struct.calcsize(cls.format))
+        buf = safe_recv(sock, cls._struct.size)
 
-        (res,) = struct.unpack(cls.format, buf)
+        (res,) = cls._struct.unpack(buf)
 
         return cls(res)
 
@@ -94,9 +101,9 @@ class mc_nettype:
         if not cls.format:
             raise NotImplementedError("format undefined for mc_type subclass {}".format(cls.__name__))
 
-        buf = fp.read(struct.calcsize(cls.format))
+        buf = fp.read(cls._struct.size)
 
-        (res,) = struct.unpack(cls.format, buf)
+        (res,) = cls._struct.unpack(buf)
 
         return cls(res)
 
@@ -105,7 +112,7 @@ class mc_nettype:
             raise NotImplementedError("format undefined for mc_type subclass {}".format(type(self).__name__))
 
         try:
-            return struct.pack(self.format, self)
+            return self._struct.pack(self)
         except struct.error:
             raise ProtocolError("invalid value for mc_type ({})".format(type(self).__name__))
 
@@ -117,6 +124,7 @@ class mc_nettype:
 
 class mc_nbttype:
 
+    __slots__ = ()  # the builtin based types can't add slots of their own
     nbt_type = type(None)
     _default = None
 
@@ -161,14 +169,10 @@ class mc_varnum(mc_nettype, int):
 
     @classmethod
     def read(cls, fp):
-        buf = fp.read(1)
-        while buf[0] & 0x80 and len(buf) < 32:
-            nxt = fp.read(1)
-            if not nxt:
-                break
-            buf = nxt + buf
-
-        return cls.from_bytes(buf)
+        try:
+            return cls(varint.read(fp, cls._width))
+        except ValueError:
+            raise ProtocolError("{} too long".format(cls.__name__))
 
     @classmethod
     def recv(cls, sock):
@@ -179,22 +183,10 @@ class mc_varnum(mc_nettype, int):
         return cls.from_bytes(buf)
 
     def __bytes__(self):
-        x = type(self)(signed_to_unsigned(self, self._width))
-        length = len(x)
-        buf = bytearray(length)
-        for i, e in enumerate(buf):
-            buf[i] = (x >> (7*i)) & 0x7f
-            if i < length-1:
-                buf[i] |= 0x80
-
-        return bytes(buf)
+        return varint.encode(self, self._width)
 
     def __len__(self):
-        length = 1
-        while self >= (1 << (7*length)):
-            length += 1
-
-        return length
+        return varint.size(self, self._width)
 
 class mc_varint(mc_varnum):
     _width = 32
@@ -232,7 +224,7 @@ class mc_string(mc_nettype, mc_nbttype, str):
 
     def bytes(self):
         res = self.encode("utf8")
-        return bytes(mc_varint(len(res))) + res
+        return varint.encode(len(res)) + res
 
 class mc_bytes(mc_nettype, mc_nbttype, bytes):
 
@@ -253,7 +245,12 @@ class mc_bytes(mc_nettype, mc_nbttype, bytes):
         return cls(array)
 
     def bytes(self):
-        return bytes(mc_varint(len(self))) + self
+        return varint.encode(len(self)) + self
+
+    def to_nbt(self):
+        result = self.nbt_type()
+        result.value = bytearray(self)
+        return result
 
 class mc_byte_array(mc_nbttype, bytes):
 
@@ -262,6 +259,11 @@ class mc_byte_array(mc_nbttype, bytes):
     def bytes(self):
         return self
 
+    def to_nbt(self):
+        result = self.nbt_type()
+        result.value = bytearray(self)
+        return result
+
 class mc_pos(mc_nettype, list):
 
     @classmethod
@@ -393,7 +395,7 @@ class mc_list(mc_nbttype, list):
         self.item_type = item_type
 
     @classmethod
-    def from_nbt(cls, tag, sub_type=None):
+    def from_nbt(cls, tag, sub_type=None, lazy=False):
         if not isinstance(tag, cls.nbt_type):
             raise ValueError("invalid type for {}: {} instead of {}".format(
                 cls.__name__, type(tag).__name__, cls.nbt_type.__name__))
@@ -407,9 +409,12 @@ class mc_list(mc_nbttype, list):
             raise ValueError("invalid list value type for {}: {}".format(
                 cls.__name__, tag.tagID))
 
+        lazy = lazy and sub_type is not None and issubclass(sub_type, mc_comp)
         result = cls(item_type)
         for item in tag:
-            if sub_type is not None:
+            if lazy:
+                result.append(sub_type.from_nbt(item, lazy=True))
+            elif sub_type is not None:
                 result.append(sub_type.from_nbt(item))
             else:
                 result.append(item)
@@ -424,7 +429,11 @@ class mc_list(mc_nbttype, list):
             else:
                 items.append(item)
 
-        result = self.nbt_type(self.item_type)
+        item_type = self.item_type
+        if issubclass(item_type, mc_nbttype):
+            item_type = item_type.nbt_type
+
+        result = self.nbt_type(item_type)
         for item in items:
             result.append(item)
 
@@ -440,26 +449,40 @@ class mc_field:
         self.container = container_cls
         self.recursive = False
         self.optional = optional
+        self.slot = None
 
     def get_new(self):
         return self.container.get_default()
 
     def __get__(self, instance, owner):
-        if self.key in instance._values:
-            return instance._values[self.key]
-        else:
+        if instance is None:
+            return self
+
+        try:
+            return getattr(instance, self.slot)
+        except AttributeError:
+            if self.key in instance._pending:
+                return instance._decode(self)
             return self.get_new()
 
     def __set__(self, instance, value):
         if not isinstance(value, self.container):
             value = self.container(value)
-        instance._values[self.key] = value
+        setattr(instance, self.slot, value)
+        if instance._pending:
+            instance._pending.pop(self.key, None)
+
+    def from_nbt(self, tag, lazy=False):
+        if lazy and issubclass(self.container, mc_comp):
+            return self.container.from_nbt(tag, lazy=True)
 
-    def from_nbt(self, tag):
         return self.container.from_nbt(tag)
 
-    def from_nbt_recursive(self, tag, cls):
-        return self.from_nbt(tag)
+    def from_nbt_recursive(self, tag, cls, lazy=False):
+        return self.from_nbt(tag, lazy)
+
+    def decoder(self, cls):
+        return self.container.from_nbt
 
 class mc_list_field(mc_field):
 
@@ -485,8 +508,8 @@ class mc_list_field(mc_field):
 
         return result
 
-    def from_nbt(self, tag):
-        return self.container.from_nbt(tag, sub_type=self.item_type)
+    def from_nbt(self, tag, lazy=False):
+        return self.container.from_nbt(tag, sub_type=self.item_type, lazy=lazy)
 
     def __set__(self, instance, value):
         if not isinstance(value, mc_list):
@@ -499,12 +522,17 @@ class mc_list_field(mc_field):
             except (TypeError, ValueError):
                 pass
 
-            instance._values[self.key] = result
-        else:
-            instance._values[self.key] = value
+            value = result
 
-    def from_nbt_recursive(self, tag, cls):
-        return self.container.from_nbt(tag, sub_type=cls)
+        setattr(instance, self.slot, value)
+        if instance._pending:
+            instance._pending.pop(self.key, None)
+
+    def from_nbt_recursive(self, tag, cls, lazy=False):
+        return self.container.from_nbt(tag, sub_type=cls, lazy=lazy)
+
+    def decoder(self, cls):
+        return partial(self.container.from_nbt, sub_type=cls if self.recursive else self.item_type)
 
 class mc_uuid_field:  # pseudo field
 
@@ -565,51 +593,141 @@ class mc_split_pos_field:  # pseudo field
         self.y_field.__set__(instance, value.y)
         self.z_field.__set__(instance, value.z)
 
+IMMUTABLE_TYPES = (int, float, str, bytes)
+
+def _compile(name, lines, env):
+    exec("\n".join(lines), env)
+    return env[name]
+
 class mc_comp_meta(type):
 
     def __new__(cls, name, bases, namespace, **kwargs):
-        result = type.__new__(cls, name, bases, namespace)
-        result._fields = [v for v in namespace.values() if isinstance(v, mc_field)]
-
-        return result
+        # field values live in a slot per field, the descriptors read and write through it
+        slots = list(namespace.get("__slots__", ()))
+        for attr, value in namespace.items():
+            if isinstance(value, mc_field):
+                value.slot = "_v_" + attr
+                if not any(hasattr(base, value.slot) for base in bases):
+                    slots.append(value.slot)
+        namespace["__slots__"] = tuple(slots)
 
-class mc_comp(mc_nbttype, metaclass=mc_comp_meta):
+        result = type.__new__(cls, name, bases, namespace)
 
-    nbt_type = nbt.TAG_Compound
+        fields = {}
+        for klass in reversed(result.__mro__):
+            for attr, value in vars(klass).items():
+                if isinstance(value, mc_field):
+                    fields[attr] = value
+        result._fields = list(fields.values())
+        result._keys = {field.key: field for field in result._fields}
 
-    def __init__(self):
-        self.nbt = None
+        cls._compile(result, namespace)
+        return result
 
-        self._keys = {}
-        self._values = {}
-        for field in self._fields:
-            self._keys[field.key] = field
+    def _compile(self, namespace):
+        env = {"TAG_Compound": nbt.TAG_Compound}
+        init = [
+            "def _init_fields(self):",
+            "    self.nbt = None",
+            "    self._lazy = False",
+            "    self._pending = {}"
+        ]
+        to_nbt = [
+            "def to_nbt(self):",
+            "    if getattr(self.nbt, 'partial', False):",
+            "        raise ValueError('{} was read without the tags its schema skips'.format(type(self).__name__))",
+            "    result = self.nbt if self.nbt is not None else TAG_Compound()",
+            "    tags = result.tags",
+            "    index = {tag.name: pos for pos, tag in enumerate(tags)}"
+        ]
+        decoders = {}
+        for i, field in enumerate(self._fields):
+            env["_f{}".format(i)] = field
             if not field.optional:
-                self._values[field.key] = field.get_new()
+                default = field.get_new()
+                if isinstance(default, IMMUTABLE_TYPES):  # safe to share between instances
+                    env["_d{}".format(i)] = default
+                    init.append("    self.{} = _d{}".format(field.slot, i))
+                else:
+                    init.append("    self.{} = _f{}.get_new()".format(field.slot, i))
+
+            to_nbt += [
+                "    value = getattr(self, {!r}, None)".format(field.slot),
+                "    if value is not None:",
+                "        tag = value.to_nbt()",
+                "        tag.name = {!r}".format(field.key),
+                "        pos = index.get({!r})".format(field.key),
+                "        if pos is None:",
+                "            tags.append(tag)",
+                "        else:",
+                "            tags[pos] = tag"
+            ]
+            decoders[field.key] = (field.slot, field.decoder(self))
+
+        to_nbt.append("    return result")
+        env["decoders"] = decoders
+        from_nbt = [
+            "def from_nbt(cls, tag, lazy=False):",
+            "    if not isinstance(tag, cls.nbt_type):",
+            "        raise ValueError('invalid type for {}: {} instead of {}'.format(",
+            "            cls.__name__, type(tag).__name__, cls.nbt_type.__name__))",
+            "    self = cls()",
+            "    self.nbt = tag",
+            "    if lazy:",
+            "        self._defer(tag)",
+            "        return self",
+            "    for child in tag.tags:",
+            "        decoder = decoders.get(child.name)",
+            "        if decoder is not None:",
+            "            setattr(self, decoder[0], decoder[1](child))",
+            "    return self"
+        ]
+
+        self._init_fields = _compile("_init_fields", init, env)
+        self._init_fields._field_init = True
+        if "__init__" not in namespace and getattr(self.__init__, "_field_init", False):
+            self.__init__ = self._init_fields
+        if "from_nbt" not in namespace:
+            self.from_nbt = classmethod(_compile("from_nbt", from_nbt, env))
+        if "to_nbt" not in namespace:
+            self.to_nbt = _compile("to_nbt", to_nbt, env)
 
-    @classmethod
-    def from_nbt(cls, tag):
-        if not isinstance(tag, cls.nbt_type):
-            raise ValueError("invalid type for {}: {} instead of {}".format(
-                cls.__name__, type(tag).__name__, cls.nbt_type.__name__))
+class mc_comp(mc_nbttype, metaclass=mc_comp_meta):
 
-        result = cls()
-        result.nbt = tag
-        for nbt_key, field in result._keys.items():
-            if nbt_key in tag:
-                if field.recursive:
-                    field.__set__(result, field.from_nbt_recursive(tag[nbt_key], cls))
-                else:
-                    field.__set__(result, field.from_nbt(tag[nbt_key]))
+    __slots__ = ("nbt", "_lazy", "_pending")
+    nbt_type = nbt.TAG_Compound
 
-        return result
+    # from_nbt(tag, lazy=False), to_nbt() and _init_fields() are generated per class by mc_comp_meta
 
-    def to_nbt(self):
-        result = self.nbt if self.nbt is not None else self.nbt_type()
-        for nbt_key, value in self._values.items():
-            result[nbt_key] = value.to_nbt()
+    def __init__(self):
+        self._init_fields()
+
+    __init__._field_init = True
+
+    def _defer(self, tag):
+        # fields are decoded from the backing tag on first access, see _decode
+        self._lazy = True
+        for child in tag.tags:
+            field = self._keys.get(child.name)
+            if field is not None:
+                try:
+                    delattr(self, field.slot)
+                except AttributeError:
+                    pass
+                self._pending[child.name] = child
+
+    def _decode(self, field):
+        tag = self._pending.get(field.key)
+        if tag is None:  # decoded by another thread in between
+            return field.__get__(self, type(self))
+
+        if field.recursive:
+            value = field.from_nbt_recursive(tag, type(self), self._lazy)
+        else:
+            value = field.from_nbt(tag, self._lazy)
 
-        return result
+        field.__set__(self, value)
+        return getattr(self, field.slot)
 
 class mc_chunk_section(mc_nettype):
 
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+# VarInt/VarLong codec working on buffers and offsets. The pure Python
+# functions below are always available as py_*; when the optional C
+# extension has been built, encode/encode_into/decode/size come from it:
+#
+#   gcc -O2 -shared -fPIC $(python3-config --includes) claspymc/_varint.c \
+#       -o claspymc/_varint$(python3-config --extension-suffix)
+#
+# Overlong values raise ValueError, truncated input raises IndexError.
+
+__author__ = 'Thomas Bell'
+
+MAX_BYTES = {32: 5, 64: 10}
+
+# every value below 16384 pre-encoded, which covers packet ids, most lengths and palettes
+ENCODED = [bytes((i,)) if i < 0x80 else bytes(((i & 0x7F) | 0x80, i >> 7)) for i in range(0x4000)]
+
+def py_encode(value, width=32):
+    if 0 <= value < 0x4000:
+        return ENCODED[value]
+
+    value &= (1 << width) - 1
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+def py_encode_into(buf, offset, value, width=32):
+    # returns the offset after the encoded value
+    if 0 <= value < 0x80:
+        buf[offset] = value
+        return offset + 1
+
+    if 0 <= value < 0x4000:
+        buf[offset] = (value & 0x7F) | 0x80
+        buf[offset + 1] = value >> 7
+        return offset + 2
+
+    data = py_encode(value, width)
+    end = offset + len(data)
+    buf[offset:end] = data
+    return end
+
+def py_decode(buf, offset=0, width=32):
+    # returns (value, offset after the value)
+    b = buf[offset]
+    if b < 0x80:
+        return b, offset + 1
+
+    result = b & 0x7F
+    b = buf[offset + 1]
+    if b < 0x80:
+        return result | (b << 7), offset + 2
+
+    result |= (b & 0x7F) << 7
+    shift = 14
+    for i in range(offset + 2, offset + MAX_BYTES[width]):
+        b = buf[i]
+        result |= (b & 0x7F) << shift
+        if b < 0x80:
+            result &= (1 << width) - 1
+            if result >> (width - 1):
+                result -= 1 << width
+            return result, i + 1
+        shift += 7
+
+    raise ValueError("VarInt too long")
+
+def py_size(value, width=32):
+    if 0 <= value < 0x80:
+        return 1
+    elif 0 <= value < 0x4000:
+        return 2
+
+    value &= (1 << width) - 1
+    return max(1, (value.bit_length() + 6) // 7)
+
+def read(fp, width=32):
+    # reads a value from a file-like object one byte at a time
+    result = 0
+    for i in range(MAX_BYTES[width]):
+        data = fp.read(1)
+        if not data:
+            raise IndexError("VarInt truncated")
+
+        b = data[0]
+        result |= (b & 0x7F) << (7*i)
+        if b < 0x80:
+            result &= (1 << width) - 1
+            if result >> (width - 1):
+                result -= 1 << width
+            return result
+
+    raise ValueError("VarInt too long")
+
+encode = py_encode
+encode_into = py_encode_into
+decode = py_decode
+size = py_size
+
+try:
+    from ._varint import encode, encode_into, decode, size
+    accelerated = True
+except ImportError:
+    accelerated = False
@@ -2,12 +2,19 @@
 
 import os
 import os.path
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 from math import ceil
 
-from nbt import chunk, nbt, region, world
+import numpy as np
+from nbt import nbt
 
+from . import nbtstream, varint
 from .entity import Entity, PlayerEntity
+from .region import RegionFile, RegionClosed
 from .types import \
     mc_comp, mc_int, mc_bool, \
     mc_string, mc_long, mc_double, \
@@ -15,6 +22,16 @@ from .types import \
     mc_list_field, mc_split_pos_field, \
     mc_byte_array, mc_varint, mc_vec3f
 
+def pack_longs(values, bits):
+    # values are laid out as a little-endian bit stream over a big-endian long array
+    shifts = np.arange(bits, dtype=values.dtype)
+    stream = ((values[:, np.newaxis] >> shifts) & 1).astype(np.uint8)
+    packed = np.packbits(stream.ravel(), bitorder='little')
+    if len(packed) % 8:
+        packed = np.concatenate((packed, np.zeros(8 - len(packed) % 8, dtype=np.uint8)))
+
+    return packed.view('<u8').astype('>u8').tobytes()
+
 class LevelData(mc_comp):
 
     version = mc_field("version", mc_int)
@@ -51,18 +68,56 @@ class Section(mc_comp):
     sky_light = mc_field("SkyLight", mc_byte_array)
 
     BITS_PER_BLOCK = 13
+    MIN_PALETTE_BITS = 4
+    MAX_PALETTE_BITS = 8
     INDICES_PER_SECTION = 4096
     TOTAL_BITS = INDICES_PER_SECTION * BITS_PER_BLOCK
     DATA_LENGTH = ceil(TOTAL_BITS / 8)
 
-    def bytes(self):
-        payload = b''
-        payload += mc_ubyte(self.BITS_PER_BLOCK).bytes()
-        payload += mc_varint(0).bytes()
+    def _has_add(self):
+        return self.nbt is not None and self.nbt.get("Add", None) is not None
+
+    def _array(self, field):
+        # undecoded byte arrays are read straight from the backing tag
+        tag = self._pending.get(field.key)
+        if tag is not None:
+            return tag.value
+
+        return field.__get__(self, type(self))
+
+    def block_ids(self):
+        # merge Blocks, Add and Data into global palette ids
+        ids = np.frombuffer(self._array(Section.blocks), dtype=np.uint8).astype(np.uint16)
+        if self._has_add():
+            add = np.frombuffer(self._array(Section.add), dtype=np.uint8).astype(np.uint16)
+            ids[0::2] |= (add & 0x0F) << 8
+            ids[1::2] |= (add >> 4) << 8
+
+        data = np.frombuffer(self._array(Section.data), dtype=np.uint8).astype(np.uint16)
+        ids <<= 4
+        ids[0::2] |= data & 0x0F
+        ids[1::2] |= data >> 4
+
+        ids &= (1 << self.BITS_PER_BLOCK) - 1
+        return ids
+
+    def _pack_data(self):
+        return pack_longs(self.block_ids(), self.BITS_PER_BLOCK)
+
+    def palette(self):
+        # returns (palette, indices, bits), palette is None for the global palette
+        ids = self.block_ids()
+        palette, indices = np.unique(ids, return_inverse=True)
+        bits = max(self.MIN_PALETTE_BITS, (len(palette) - 1).bit_length())
+        if bits > self.MAX_PALETTE_BITS:
+            return None, ids, self.BITS_PER_BLOCK
 
+        return palette, indices.astype(np.uint16), bits
+
+    def _pack_data_reference(self):
         s_blocks = self.blocks
         s_add = None
-        if hasattr(self, "nbt") and self.nbt.get("Add", None) is not None:
+        if self._has_add():
             s_add = self.add
 
         s_data = self.data
@@ -86,14 +141,32 @@ class Section(mc_comp):
             item &= ((1 << self.BITS_PER_BLOCK) - 1)
             item <<= data_off
             while item != 0:
-                data[data_idx] = item & 0xFF
+                data[data_idx] |= item & 0xFF
                 item >>= 8
                 data_idx += 1
 
-        payload += mc_varint(len(data)).bytes()
-        payload += bytes(data)
-        payload += self.block_light.bytes()
-        payload += self.sky_light.bytes()
+        # the bit stream is little-endian, longs go out big-endian
+        for i in range(0, len(data), 8):
+            data[i:i+8] = data[i:i+8][::-1]
+
+        return bytes(data)
+
+    def bytes(self):
+        palette, values, bits = self.palette()
+
+        payload = b''
+        payload += mc_ubyte(bits).bytes()
+        if palette is None:
+            payload += mc_varint(0).bytes()
+        else:
+            payload += mc_varint(len(palette)).bytes()
+            payload += b''.join(varint.encode(int(x)) for x in palette)
+
+        data = pack_longs(values, bits)
+        payload += mc_varint(len(data) // 8).bytes()
+        payload += data
+        payload += self._array(Section.block_light)
+        payload += self._array(Section.sky_light)
         return payload
 
 
@@ -118,7 +191,10 @@ class ChunkContainer(mc_comp):
 
 class MCWorld:
 
-    def __init__(self, path):
+    MAX_CHUNKS = 1024
+    MAX_REGIONS = 16
+    LOADER_THREADS = 2
+    def __init__(self, path, max_chunks=None, max_regions=None, loader_threads=None, lazy_nbt=True):
         if not os.path.isdir(path):
             raise NotADirectoryError("MCWorld base path must exist and be a directory.")
 
@@ -133,32 +209,163 @@ class MCWorld:
 
         self.level_container = LevelContainer.from_nbt(self.level_nbt)
         self.level = self.level_container.data
-        self.regions = {}
-        self.chunks = {}
 
-    def get_region(self, x, z, dimension=0):
-        if (dimension, x, z) in self.regions:
-            return self.regions[(dimension, x, z)]
-
-        path = self.base
-        if dimension != 0:
-            path /= "DIM{}".format(dimension)
-        path /= "region"
-        path /= "r.{}.{}.mca".format(x, z)
+        self.lock = threading.RLock()
+        self.max_chunks = max_chunks or self.MAX_CHUNKS
+        self.max_regions = max_regions or self.MAX_REGIONS
+        self.lazy_nbt = lazy_nbt
+        self.regions = OrderedDict()
+        self.chunks = OrderedDict()
+        self.pins = {}
+        self.pinned = {}
+        self.loading = {}
+        self.pool = ThreadPoolExecutor(max_workers=loader_threads or self.LOADER_THREADS,
+                                       thread_name_prefix="chunk-loader")
+        self.stats = {
+            "chunk_hits": 0,
+            "chunk_misses": 0,
+            "chunk_evictions": 0,
+            "region_hits": 0,
+            "region_misses": 0,
+            "region_evictions": 0
+        }
+
+        self.chunk_stamps = {}
+        self.chunk_listeners = []
 
-        file = region.RegionFile(path)
-        self.regions[(dimension, x, z)] = file
-        return file
+    def get_region(self, x, z, dimension=0):
+        with self.lock:
+            key = (dimension, x, z)
+            if key in self.regions:
+                self.regions.move_to_end(key)
+                self.stats["region_hits"] += 1
+                return self.regions[key]
+
+            path = self.base
+            if dimension != 0:
+                path /= "DIM{}".format(dimension)
+            path /= "region"
+            path /= "r.{}.{}.mca".format(x, z)
+
+            file = RegionFile(path)
+            self.regions[key] = file
+            self.stats["region_misses"] += 1
+
+            while len(self.regions) > self.max_regions:
+                _, evicted = self.regions.popitem(last=False)
+                evicted.close()
+                self.stats["region_evictions"] += 1
+
+            return file
+
+    def request_chunk(self, x, z, dimension=0):
+        # concurrent requests for the same chunk share one load
+        with self.lock:
+            key = (dimension, x, z)
+            if key in self.chunks:
+                self.chunks.move_to_end(key)
+                self.stats["chunk_hits"] += 1
+                future = Future()
+                future.set_result(self.chunks[key].level)
+                return future
+
+            if key in self.loading:
+                self.stats["chunk_hits"] += 1
+                return self.loading[key]
+
+            self.stats["chunk_misses"] += 1
+            future = self.pool.submit(self._load_chunk, key)
+            self.loading[key] = future
+            return future
+
+    async def load_chunk(self, x, z, dimension=0):
+        return await asyncio.wrap_future(self.request_chunk(x, z, dimension))
 
     def get_chunk(self, x, z, dimension=0):
-        if (dimension, x, z) in self.chunks:
-            return self.chunks[(dimension, x, z)].level
-
-        reg = self.get_region(x >> 5, z >> 5, dimension=dimension)
-        root = reg.get_nbt(x & 0x1f, z & 0x1f)
-        container = ChunkContainer.from_nbt(root)
-        self.chunks[(dimension, x, z)] = container
-        return container.level
+        return self.request_chunk(x, z, dimension).result()
+
+    def _load_chunk(self, key):
+        dimension, x, z = key
+        try:
+            # region files are mapped, so reads can run in parallel outside the lock
+            while True:
+                reg = self.get_region(x >> 5, z >> 5, dimension=dimension)
+                try:
+                    data = reg.get_blockdata(x & 0x1f, z & 0x1f)
+                    break
+                except RegionClosed:  # evicted in between
+                    continue
+
+            # only what the schema declares is parsed, byte arrays stay views into
+            # data. What was skipped is lost, so the container can't be saved.
+            root = nbtstream.read(data, ChunkContainer)
+            container = ChunkContainer.from_nbt(root, lazy=self.lazy_nbt)
+
+            with self.lock:
+                self.chunks[key] = container
+                self._evict_chunks()
+
+            return container.level
+
+        finally:
+            with self.lock:
+                self.loading.pop(key, None)
+
+    def _evict_chunks(self):
+        # pinned chunks are rotated to the back rather than evicted
+        skipped = 0
+        while len(self.chunks) > self.max_chunks and skipped < len(self.chunks):
+            key = next(iter(self.chunks))
+            if key in self.pinned:
+                self.chunks.move_to_end(key)
+                skipped += 1
+            else:
+                del self.chunks[key]
+                self.stats["chunk_evictions"] += 1
+
+    def pin_chunks(self, owner, keys):
+        with self.lock:
+            self.unpin_chunks(owner)
+            self.pins[owner] = keys
+            for key in keys:
+                self.pinned[key] = self.pinned.get(key, 0) + 1
+
+    def unpin_chunks(self, owner):
+        with self.lock:
+            for key in self.pins.pop(owner, ()):
+                self.pinned[key] -= 1
+                if self.pinned[key] <= 0:
+                    del self.pinned[key]
+
+    def cache_stats(self):
+        with self.lock:
+            result = dict(self.stats)
+            result.update({
+                "chunks": len(self.chunks),
+                "max_chunks": self.max_chunks,
+                "pinned_chunks": len(self.pinned),
+                "regions": len(self.regions),
+                "max_regions": self.max_regions
+            })
+            return result
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        with self.lock:
+            for file in self.regions.values():
+                file.close()
+
+            self.regions.clear()
+            self.chunks.clear()
+
+    def chunk_stamp(self, x, z, dimension=0):
+        return self.chunk_stamps.get((dimension, x, z), 0)
+
+    def mark_chunk_dirty(self, x, z, dimension=0):
+        key = (dimension, x, z)
+        self.chunk_stamps[key] = self.chunk_stamps.get(key, 0) + 1
+        for callback in self.chunk_listeners:
+            callback(key)
 
     def get_player(self, uuid):
         path = self.base / "playerdata" / "{}.dat".format(uuid)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+import sys
+import zlib
+import argparse
+from collections import Counter
+
+from . import varint
+from .capture import read_capture, frame_body
+from .compress import ZlibCodec
+from .packet import ChunkData
+from .trace import OUTBOUND
+
+__author__ = 'Thomas Bell'
+
+# Builds a preset zlib dictionary from ChunkData payloads in session
+# captures, for the compressed chunk cache:
+#
+#   python -m claspymc.zdict session.cap -o chunks.zdict
+#
+# The network protocol has no way to agree on a dictionary, so this is
+# only for data the server keeps to itself.
+
+MAX_SIZE = 32768  # the deflate window, anything before it is never used
+SEGMENT = 32
+
+def build(samples, size=MAX_SIZE, segment=SEGMENT):
+    # the segments found in most samples, the most common last since deflate
+    # codes nearer matches in fewer bits
+    counts = Counter()
+    for sample in samples:
+        counts.update(set(sample[i:i+segment] for i in range(0, len(sample) - segment + 1, segment // 2)))
+
+    chosen = []
+    for data, count in counts.most_common():
+        if count < 2 or len(chosen) * segment >= size:
+            break
+        # runs of one byte compress well without help
+        if data.count(data[:1]) != len(data):
+            chosen.append(data)
+
+    return b''.join(reversed(chosen))[-size:]
+
+def chunk_samples(fp, packet_id=ChunkData.packet_id):
+    for record in read_capture(fp):
+        if record.direction != OUTBOUND:
+            continue
+
+        body = frame_body(record.frame, record.compression)
+        if varint.decode(body)[0] == packet_id:
+            yield body
+
+def compressed_size(samples, codec):
+    return sum(len(codec.compress(sample)) for sample in samples)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a zlib dictionary from captured chunk packets.")
+    parser.add_argument("captures", nargs="+", type=argparse.FileType("rb"))
+    parser.add_argument("-o", "--output", required=True, help="Where to write the dictionary.")
+    parser.add_argument("-s", "--size", type=int, default=MAX_SIZE, help="Dictionary size in bytes.")
+    parser.add_argument("-l", "--level", type=int, default=1, help="Compression level to report ratios for.")
+    args = parser.parse_args()
+
+    samples = []
+    for fp in args.captures:
+        samples.extend(chunk_samples(fp))
+
+    if len(samples) < 2:
+        print("need at least two chunk packets, found {}".format(len(samples)), file=sys.stderr)
+        sys.exit(1)
+
+    # every fifth sample is held out to see how the dictionary does on new chunks
+    held_out = samples[::5]
+    training = [sample for i, sample in enumerate(samples) if i % 5]
+    zdict = build(training, min(args.size, MAX_SIZE))
+    with open(args.output, "wb") as f:
+        f.write(zdict)
+
+    raw = sum(len(sample) for sample in held_out)
+    plain = compressed_size(held_out, ZlibCodec(args.level))
+    preset = compressed_size(held_out, ZlibCodec(args.level, zdict))
+    print("{} chunk packets, {} byte dictionary".format(len(samples), len(zdict)))
+    print("held out: {} bytes, {} compressed ({:.3f}), {} with dictionary ({:.3f})".format(
+        raw, plain, plain / raw, preset, preset / raw))
+
+if __name__ == "__main__":
+    main()